@@ -0,0 +1,9 @@
+"""Let the tests import custom_components from the repository root.
+
+tools/ is put on the path too, so tests can run against the simulators.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'tools'))
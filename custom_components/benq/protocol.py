@@ -0,0 +1,102 @@
+"""BenQ projector RS-232 protocol: answer parsing and pipelined queries."""
+
+import logging
+import re
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Every answer ends with this, the echo of a command with \r before it
+TERMINATOR = b'\r\n'
+
+_COMMAND_RE = re.compile(r'\*(?P<item>\w+)=(?P<value>[^#]*)#')
+
+
+def command_item(command):
+    """Return the lower case item a command reads or sets, e.g. pow."""
+    match = _COMMAND_RE.search(command)
+    if match is None:
+        return None
+    return match.group('item').lower()
+
+
+def echoed_command(frame):
+    """Return the lower case command a frame echoes, e.g. *pow=on#, or None."""
+    line = frame.decode(errors='replace').strip()
+    if not line.startswith('>'):
+        return None
+    match = _COMMAND_RE.search(line)
+    return None if match is None else match.group(0).lower()
+
+
+class BenQParser:
+    """Turn the projector's output lines into answers.
+
+    The projector echoes every command (>*pow=?#) before answering it
+    (*POW=ON#). Answers carry the item they are for, except errors such as
+    *Illegal format# or *Block item#, which belong to the last echoed command.
+    """
+
+    def __init__(self):
+        """Initialize the parser."""
+        self._echoed = None
+
+    def reset(self):
+        """Forget the last echoed command, e.g. after a reconnect."""
+        self._echoed = None
+
+    def parse(self, frame):
+        """Return (item, value) if a frame is an answer, else None.
+
+        value is None for an error answer.
+        """
+        line = frame.decode(errors='replace').strip()
+        if line.startswith('>'):
+            self._echoed = command_item(line)
+        elif line.startswith('*') and line.endswith('#'):
+            match = _COMMAND_RE.fullmatch(line)
+            if match is None:
+                return self._echoed, None
+            return match.group('item').lower(), match.group('value')
+        return None
+
+
+async def async_exchange(connection, parser, commands, timeout):
+    """Send commands back to back and return their answers by item.
+
+    Answers are matched to the commands by item, so one round trip answers
+    them all. An item's answer only counts after the echo of its command,
+    so a late answer to an earlier exchange is not taken for this one's.
+    Returns a dict item -> value, None for an error answer, without the
+    items that got no answer within timeout seconds. Raises OSError if the
+    connection fails.
+    """
+    # dict echoed command -> item it answers
+    expected = {_COMMAND_RE.search(command).group(0).lower():
+                command_item(command) for command in commands}
+    pending = set(expected.values())
+    echoed = set()
+    answers = {}
+    await connection.write(''.join(commands).encode())
+    deadline = time.monotonic() + timeout
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        frame = await connection.read_frame(remaining)
+        if frame is None:
+            break
+        echo = echoed_command(frame)
+        if echo in expected:
+            echoed.add(expected[echo])
+        answer = parser.parse(frame)
+        if answer is None:
+            continue
+        item, value = answer
+        if item in pending and item in echoed:
+            pending.discard(item)
+            answers[item] = value
+        else:
+            # e.g. the answer to a query that already timed out
+            _LOGGER.debug("Ignoring answer %s=%s", item, value)
+    return answers
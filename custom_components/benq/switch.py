@@ -1,10 +1,10 @@
 """Use serial protocol of BenQ projector to obtain state of the projector."""
 # From https://github.com/Emily9121/Serial-BenQ-Projector-Home-Assistant-Integration
 #
+import asyncio
 import logging
-import codecs
-import re
 import time
+from datetime import timedelta
 
 import voluptuous as vol
 
@@ -13,13 +13,21 @@ from homeassistant.const import (
     CONF_HOST,
     CONF_PORT,
     CONF_NAME,
+    CONF_SCAN_INTERVAL,
+    EVENT_HOMEASSISTANT_STOP,
     STATE_OFF,
     STATE_ON,
     STATE_UNKNOWN,
 )
+from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.event import async_track_time_interval
 
-REQUIREMENTS = ['pyitachip2sl==0.1']
+from ..entity_state.entity import WriteIfChangedMixin
+from ..ip2sl.connection import IP2SLConnection
+from ..metrics import async_register_metrics
+from ..metrics.stats import Metrics
+from .protocol import TERMINATOR, BenQParser, async_exchange, command_item
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -55,6 +63,26 @@ CMD_DICT = {
 
 DEFAULT_PORT = 4999
 
+# The switch polls itself, so that an unchanged projector is not written to
+# Home Assistant on every poll; scan_interval still overrides this
+SCAN_INTERVAL = timedelta(seconds=30)
+
+# Seconds an attribute is cached, None keeps it until the connection is
+# reopened. The power state is queried on every update.
+ATTRIBUTE_TTL = {
+    INPUT_SOURCE: 60,
+    LAMP_MODE: 60,
+    LAMP_HOURS: 3600,
+    MODEL: None,
+}
+
+# Power queries in a row without an answer after which the connection is
+# reopened
+MAX_MISSED_ANSWERS = 2
+
+# Attributes the projector only reports while it is on
+NEEDS_POWER = (INPUT_SOURCE, LAMP_MODE)
+
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
         vol.Required(CONF_HOST): cv.string,
@@ -68,7 +96,8 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities,
+                               discovery_info=None):
     """Setup BenQ Projector platform."""
 
     port = config[CONF_PORT]
@@ -77,55 +106,105 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     timeout = config[CONF_TIMEOUT]
     write_timeout = config[CONF_WRITE_TIMEOUT]
 
-    from pyitachip2sl import ITachIP2SLSocketClient
+    itach_serial = IP2SLConnection(hostname, port, timeout, TERMINATOR)
 
-    try:
-        itach_serial = ITachIP2SLSocketClient(hostname, port, timeout)
-    except:
-        _LOGGER.error("Error connecting to iTach IP2SL")
-        return
+    @callback
+    def close(event):
+        itach_serial.close()
 
-    add_entities([BenQSwitch(itach_serial, name, hostname)], True)
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, close)
+    metrics = Metrics('benq ' + hostname)
+    async_register_metrics(hass, metrics)
 
+    # connects and reads the projector once added, see async_added_to_hass
+    async_add_entities([BenQSwitch(
+        itach_serial, name, hostname, timeout, metrics,
+        config.get(CONF_SCAN_INTERVAL, SCAN_INTERVAL))])
 
-class BenQSwitch(SwitchEntity):
+
+class BenQSwitch(WriteIfChangedMixin, SwitchEntity):
     """Represents an BenQ Projector as a switch."""
 
-    def __init__(self, itach_serial, name, hostname, **kwargs):
+    def __init__(self, itach_serial, name, hostname, timeout, metrics,
+                 scan_interval=SCAN_INTERVAL, **kwargs):
         """Init of the BenQ projector."""
 
         self._benq = itach_serial
+        self._metrics = metrics
+        self._scan_interval = scan_interval
         self._name = name
         self._hostname = hostname
+        self._timeout = timeout
         self._state = False
         self._available = False
         self._attributes = {
             LAMP_HOURS: STATE_UNKNOWN,
             INPUT_SOURCE: STATE_UNKNOWN,
             LAMP_MODE: STATE_UNKNOWN,
+            MODEL: STATE_UNKNOWN,
         }
+        # dict attribute -> time.monotonic() its cached value expires,
+        # None if it is kept for the whole connection
+        self._expires = {}
+        self._parser = BenQParser()
+        self._missed = 0
+        # the connection has one reader, updates and commands take turns
+        self._lock = asyncio.Lock()
+
+    async def _async_write_read(self, *msgs):
+        """Send commands back to back and return their answers in order.
+
+        Answers are matched to the commands by item, so one round trip
+        answers them all. A command whose answer is an error, or does not
+        arrive within the timeout, gets STATE_UNKNOWN. The round trip is
+        counted in the metrics as one request.
+        """
+        items = [command_item(msg) for msg in msgs]
+        answers = {}
+        failed = False
+        async with self._lock:
+            start = time.monotonic()
+            try:
+                answers = await async_exchange(
+                    self._benq, self._parser, msgs, self._timeout)
+            except OSError:
+                _LOGGER.error("Problem communicating with %s", self._hostname)
+                self._parser.reset()
+                failed = True
+            pending = set(items) - answers.keys()
+            self._metrics.record(
+                time.monotonic() - start, timeout=bool(pending) and not failed,
+                error=failed or None in answers.values())
+        if pending:
+            _LOGGER.debug("No answer from %s for %s", self._hostname,
+                          ", ".join(sorted(pending)))
+        return [answers.get(item) or STATE_UNKNOWN for item in items]
+
+    async def async_added_to_hass(self):
+        """Poll the projector, first without holding up the startup."""
+        self.async_on_remove(async_track_time_interval(
+            self.hass, self._async_poll, self._scan_interval))
+        self.hass.async_create_background_task(
+            self._async_poll(), 'benq {} refresh'.format(self._hostname))
+
+    async def async_will_remove_from_hass(self):
+        """Close the connection to the projector."""
+        self._benq.close()
+
+    async def _async_poll(self, now=None):
+        """Update the projector's state, writing it only if it changed."""
+        await self.async_update()
+        self._async_write_if_changed()
+
+    def _compact_state(self):
+        """Return a compact copy of the state Home Assistant shows."""
+        return (self._available, self._state,
+                tuple(self._attributes.values()))
 
-    def _write_read(self, msg):
-        """Write to the projector via iTach/GC100 and read the response."""
-
-        cmd = codecs.encode(str.encode(msg), "hex").decode()
-        try:
-            response = self._benq.send_data(cmd, True)
-            return response
-        except:
-            _LOGGER.error("Problem communicating with %s", self._hostname)
-            return None
-
-
-    def _write_read_format(self, msg):
-        """Write msg, obtain answer and format output."""
-        # answers are formatted as ***\answer\r***
-        awns = self._write_read(msg)
-        _LOGGER.info("awns IN is: %s", repr(awns))
-        match = re.search(r"\r\r\n(.+)=(.+)#", awns)
-        if match:
-            return match.group(2)
-        return STATE_UNKNOWN
+    @property
+    def should_poll(self):
+        """The switch is polled by its own timer."""
+        return False
 
     @property
     def available(self):
@@ -147,36 +226,81 @@ class BenQSwitch(SwitchEntity):
         """Return state attributes."""
         return self._attributes
 
-    def update(self):
-        """Get the latest state from the projector."""
-        msg = CMD_DICT[LAMP]
-        awns = self._write_read_format(msg)
-        _LOGGER.info("awns OUT is: %s", repr(awns))
-        if awns == "ON":
-            self._state = True
-            self._available = True
-        elif awns == "OFF":
-            self._state = False
+    async def async_update(self):
+        """Get the latest state from the projector.
+
+        The power state is read on every update, other attributes only once
+        their entry in ATTRIBUTE_TTL has expired.
+        """
+        if not self._benq.connected:
+            # fails fast while waiting to retry a failed connect
+            if not await self._benq.ensure_connected():
+                self._available = False
+                return
+            # the projector may have been swapped while disconnected
+            self._expires = {}
+            self._parser.reset()
+            self._missed = 0
+
+        now = time.monotonic()
+        keys = [key for key in ATTRIBUTE_TTL if self._expired(key, now)
+                # the projector blocks these while it is off
+                and (self._state or key not in NEEDS_POWER)]
+
+        awns, *values = await self._async_write_read(
+            CMD_DICT[LAMP], *(CMD_DICT[key] for key in keys))
+        # the update's wait includes a command holding the connection
+        self._metrics.record(time.monotonic() - now, self._name,
+                             error=awns not in ("ON", "OFF"))
+        _LOGGER.debug("awns OUT is: %s", repr(awns))
+        if awns in ("ON", "OFF"):
+            state = awns == "ON"
+            if state != self._state:
+                for key in NEEDS_POWER:
+                    self._expires.pop(key, None)
+                    if not state:
+                        self._attributes[key] = STATE_UNKNOWN
+            self._state = state
             self._available = True
+            self._missed = 0
         else:
             self._available = False
-
-        for key in self._attributes:
-            msg = CMD_DICT.get(key)
-            if msg:
-                awns = self._write_read_format(msg)
-                self._attributes[key] = awns
-                time.sleep(2)
-
-    def turn_on(self, **kwargs):
+            self._missed += 1
+            if self._missed >= MAX_MISSED_ANSWERS:
+                _LOGGER.error("No answer from %s, reconnecting",
+                              self._hostname)
+                self._benq.close()
+            return
+
+        for key, awns in zip(keys, values):
+            self._attributes[key] = awns
+            if awns != STATE_UNKNOWN:
+                ttl = ATTRIBUTE_TTL[key]
+                self._expires[key] = None if ttl is None else now + ttl
+
+    def _expired(self, key, now):
+        """Return True if the cached value of an attribute must be read."""
+        if key not in self._expires:
+            return True
+        expires = self._expires[key]
+        return expires is not None and now >= expires
+
+    async def async_turn_on(self, **kwargs):
         """Turn the projector on."""
+        if not self._benq.connected:
+            _LOGGER.error("Not connected to %s", self._hostname)
+            return
         msg = CMD_DICT[STATE_ON]
-        self._write_read(msg)
-        self._state = STATE_ON
+        await self._async_write_read(msg)
+        self._state = True
+        self._async_write_if_changed()
 
-    def turn_off(self, **kwargs):
+    async def async_turn_off(self, **kwargs):
         """Turn the projector off."""
+        if not self._benq.connected:
+            _LOGGER.error("Not connected to %s", self._hostname)
+            return
         msg = CMD_DICT[STATE_OFF]
-        self._write_read(msg)
-        self._state = STATE_OFF
-
+        await self._async_write_read(msg)
+        self._state = False
+        self._async_write_if_changed()
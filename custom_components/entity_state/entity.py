@@ -0,0 +1,31 @@
+"""Entity mixin that skips state writes Home Assistant would not show."""
+
+from homeassistant.core import callback
+
+
+class WriteIfChangedMixin:
+    """Only write an entity's state to Home Assistant when it changed.
+
+    Entities return what Home Assistant shows of their state from
+    _compact_state() and call _async_write_if_changed() after an update.
+    List the mixin before the entity base class.
+    """
+
+    # _compact_state() as last written to Home Assistant
+    _written_state = None
+
+    def _compact_state(self):
+        """Return a compact copy of the state Home Assistant shows."""
+        raise NotImplementedError
+
+    @callback
+    def async_write_ha_state(self):
+        """Write the state to Home Assistant, remembering what was written."""
+        self._written_state = self._compact_state()
+        super().async_write_ha_state()
+
+    @callback
+    def _async_write_if_changed(self):
+        """Write the state to Home Assistant, unless it is unchanged."""
+        if self._compact_state() != self._written_state:
+            self.async_write_ha_state()
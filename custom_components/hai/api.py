@@ -0,0 +1,310 @@
+"""Asynchronous client for the hai-proxy REST API."""
+
+import asyncio
+import contextlib
+import json
+import logging
+import time
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+# Consecutive failed requests that open the circuit ...
+FAILURE_THRESHOLD = 3
+# ... and seconds to wait before letting a probe request through
+RECOVERY_TIMEOUT = 30
+
+# Errors that count against the circuit breaker, besides 5xx answers
+_CONNECTION_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class HAIProxyError(Exception):
+    """Raised when hai-proxy cannot be reached or returns garbage."""
+
+
+class HAIProxyUnavailable(HAIProxyError):
+    """Raised without a request while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stop calling a failing host, then let single probe requests through."""
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD,
+                 recovery_timeout=RECOVERY_TIMEOUT):
+        """Initialize a closed breaker."""
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self):
+        """Return True while requests to the host are being refused."""
+        return self._opened_at is not None
+
+    def before_request(self):
+        """Raise HAIProxyUnavailable unless a request may be sent now."""
+        if self._opened_at is None:
+            return
+        if (self._probing or
+                time.monotonic() - self._opened_at < self._recovery_timeout):
+            raise HAIProxyUnavailable(self._name + ' is unavailable')
+        self._probing = True
+
+    def record_success(self):
+        """Close the breaker after a successful request."""
+        if self._opened_at is not None:
+            _LOGGER.warning("%s is responding again", self._name)
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def abort(self):
+        """Forget a request that ended without an answer, e.g. cancelled."""
+        self._probing = False
+
+    def record_failure(self):
+        """Count a failed request, opening the breaker at the threshold."""
+        self._failures += 1
+        if self._probing or (self._opened_at is None and
+                             self._failures >= self._failure_threshold):
+            if self._opened_at is None:
+                _LOGGER.error("%s failed %s times, pausing requests",
+                              self._name, self._failures)
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+
+class HAIProxy:
+    """Talk to one hai-proxy host over a shared aiohttp session.
+
+    Every request is counted in metrics, if given.
+    """
+
+    def __init__(self, session, host, scheme='https', metrics=None):
+        """Initialize the client."""
+        self._session = session
+        self._api_url = scheme + '://' + str(host) + '/api/'
+        self.breaker = CircuitBreaker('hai-proxy ' + str(host))
+        self._metrics = metrics
+        # cleared once hai-proxy turns out to have no bulk command endpoint
+        self._bulk_commands = True
+        # endpoints hai-proxy turned out to have no bulk GET for
+        self._no_bulk_fetch = set()
+        # dict endpoint -> (ETag, Last-Modified) of the last full response
+        self._validators = {}
+
+    @property
+    def api_url(self):
+        """Return the base URL of the REST API."""
+        return self._api_url
+
+    @contextlib.asynccontextmanager
+    async def _guard(self):
+        """Run a request through the circuit breaker.
+
+        Connection errors, timeouts and server errors (5xx) count as
+        failures; a 4xx answer shows the host is up and does not. All errors
+        are raised as HAIProxyError.
+        """
+        self.breaker.before_request()
+        start = time.monotonic()
+        try:
+            yield
+        except aiohttp.ClientResponseError as err:
+            if err.status >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            self._record(start, error=True)
+            raise HAIProxyError(err) from err
+        except _CONNECTION_ERRORS as err:
+            self.breaker.record_failure()
+            self._record(start, error=True,
+                         timeout=isinstance(err, asyncio.TimeoutError))
+            raise HAIProxyError(err) from err
+        except (ValueError, KeyError, TypeError) as err:
+            self.breaker.record_success()
+            self._record(start, error=True)
+            raise HAIProxyError(err) from err
+        except BaseException:
+            self.breaker.abort()
+            raise
+        self.breaker.record_success()
+        self._record(start)
+
+    def _record(self, start, **kwargs):
+        """Count a request that started at start in the metrics."""
+        if self._metrics is not None:
+            self._metrics.record(time.monotonic() - start, **kwargs)
+
+    async def get_units(self, unit_ids=()):
+        """Return all units keyed by unit id, or None if unchanged.
+
+        Without a bulk endpoint only the units in unit_ids are fetched.
+        """
+        return await self._get_all('light', unit_ids)
+
+    async def get_zones(self, zone_ids=()):
+        """Return all zones keyed by zone id, or None if unchanged.
+
+        Without a bulk endpoint only the zones in zone_ids are fetched.
+        """
+        return await self._get_all('zone', zone_ids)
+
+    def forget_zones(self):
+        """Make the next get_zones() return all zones, even if unchanged.
+
+        For callers that changed their copy from the zone feed or log, which
+        the validators of the last full fetch do not cover.
+        """
+        self._validators.pop('zone', None)
+
+    async def set_unit(self, unit_id, state):
+        """Send new state to a unit, return True if hai-proxy accepted it.
+
+        Raises HAIProxyError on a server error, which counts against the
+        circuit breaker, rather than reporting a rejected command.
+        """
+        async with self._guard():
+            async with self._session.put(
+                    self._api_url + 'light/' + str(unit_id), json=state) as r:
+                if r.status >= 500:
+                    r.raise_for_status()
+                return r.status == 202
+
+    async def set_units(self, states):
+        """Send new state to several units, return unit id -> accepted.
+
+        Uses the bulk endpoint when hai-proxy has one and falls back to
+        parallel per-unit requests otherwise.
+        """
+        if self._bulk_commands:
+            body = [dict(state, id=unit_id) for unit_id, state in states.items()]
+            async with self._guard():
+                async with self._session.put(
+                        self._api_url + 'light', json=body) as r:
+                    if r.status >= 500:
+                        r.raise_for_status()
+                    if r.status not in (404, 405):
+                        return {unit_id: r.status == 202 for unit_id in states}
+            self._bulk_commands = False
+
+        results = await asyncio.gather(
+            *(self.set_unit(unit_id, state) for unit_id, state in states.items()),
+            return_exceptions=True)
+        return {unit_id: result is True
+                for unit_id, result in zip(states, results)}
+
+    async def get_zone_log(self, since=None):
+        """Return the zone changes logged after sequence number since.
+
+        Returns (seq, events): the sequence number of the latest change and
+        the zone records changed after since, oldest first. events is None
+        when the log no longer reaches back to since (or since is None), so
+        the caller must fetch all zones instead. Returns None if hai-proxy
+        keeps no zone log.
+        """
+        params = {} if since is None else {'since': since}
+        async with self._guard():
+            async with self._session.get(
+                    self._api_url + 'zone/log', params=params) as r:
+                if r.status == 404:
+                    return None
+                r.raise_for_status()
+                log = await r.json(content_type=None)
+            seq = int(log['seq'])
+            events = None
+            if since is not None and not log.get('truncated'):
+                events = log['events']
+                for zone in events:
+                    zone['id'] = int(zone['id'])
+        return seq, events
+
+    async def zone_events(self):
+        """Yield zone records from the server-sent event feed.
+
+        Yields None once the feed is connected so callers can resync, then
+        runs until the connection drops, which raises HAIProxyError. Yields
+        nothing if hai-proxy has no zone feed.
+        """
+        # the feed is idle between zone changes, so only bound the connect
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=self._session.timeout.sock_connect)
+        async with contextlib.AsyncExitStack() as stack:
+            async with self._guard():
+                r = await stack.enter_async_context(self._session.get(
+                    self._api_url + 'zone/events', timeout=timeout))
+                if r.status == 404:
+                    return
+                r.raise_for_status()
+            yield None
+            try:
+                async for line in r.content:
+                    line = line.decode().strip()
+                    # ignore comments, keep-alives and other SSE fields
+                    if not line.startswith('data:'):
+                        continue
+                    zone = json.loads(line[5:])
+                    zone['id'] = int(zone['id'])
+                    yield zone
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError,
+                    KeyError) as err:
+                raise HAIProxyError(err) from err
+        raise HAIProxyError('zone feed closed by server')
+
+    async def _get_all(self, endpoint, ids):
+        """Fetch every item of an endpoint, keyed by its numeric id.
+
+        Sends the validators of the previous response and returns None,
+        without reading a body, when hai-proxy answers 304 Not Modified.
+        Falls back to fetching the items in ids one by one if hai-proxy has
+        no bulk endpoint.
+        """
+        if endpoint in self._no_bulk_fetch:
+            return await self._get_each(endpoint, ids)
+        headers = {}
+        etag, last_modified = self._validators.get(endpoint, (None, None))
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        async with self._guard():
+            async with self._session.get(
+                    self._api_url + endpoint, headers=headers) as r:
+                if r.status == 304:
+                    return None
+                if r.status not in (404, 405):
+                    r.raise_for_status()
+                    items = await r.json(content_type=None)
+                    validators = (r.headers.get('ETag'),
+                                  r.headers.get('Last-Modified'))
+                    result = {int(item['id']): item for item in items}
+                    self._validators[endpoint] = validators
+                    return result
+        _LOGGER.warning("%s has no bulk %s endpoint, fetching items one by one",
+                        self._api_url, endpoint)
+        self._no_bulk_fetch.add(endpoint)
+        return await self._get_each(endpoint, ids)
+
+    async def _get_each(self, endpoint, ids):
+        """Fetch the items in ids in parallel, keyed by their id.
+
+        Items hai-proxy does not know are left out.
+        """
+        items = await asyncio.gather(*(
+            self._get_one(endpoint, item_id) for item_id in ids))
+        return {int(item['id']): item for item in items if item is not None}
+
+    async def _get_one(self, endpoint, item_id):
+        """Fetch one item, or None if hai-proxy does not know it."""
+        async with self._guard():
+            async with self._session.get(
+                    self._api_url + endpoint + '/' + str(item_id)) as r:
+                if r.status == 404:
+                    return None
+                r.raise_for_status()
+                return await r.json(content_type=None)
@@ -2,8 +2,8 @@
 # Based on https://github.com/home-assistant/core/blob/8d68f34650eb68470113127b9e1a67d2ae753a5b/homeassistant/components/abode/binary_sensor.py
 
 import logging
+from datetime import timedelta
 
-import requests, json
 import voluptuous as vol
 
 import homeassistant.helpers.config_validation as cv
@@ -15,13 +15,27 @@ from homeassistant.components.binary_sensor import (
     BinarySensorEntity,
     PLATFORM_SCHEMA,
 )
-from homeassistant.const import CONF_HOST, CONF_ZONE, CONF_ID, CONF_NAME, CONF_DEVICE_CLASS
+from homeassistant.const import CONF_ZONE, CONF_ID, CONF_NAME, CONF_DEVICE_CLASS
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+
+from .coordinator import HOST_SCHEMA, async_get_coordinator
+from .entity import HAIEntity
 
 _LOGGER = logging.getLogger(__name__)
 
+CONF_STREAM = 'stream'
+CONF_EVENT_LOG = 'event_log'
+CONF_RESYNC_INTERVAL = 'resync_interval'
+
+DEFAULT_RESYNC_INTERVAL = timedelta(minutes=10)
+
 # Validation of the user's configuration
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
-    vol.Required(CONF_HOST): cv.string,
+    **HOST_SCHEMA,
+    vol.Optional(CONF_STREAM, default=False): cv.boolean,
+    vol.Optional(CONF_EVENT_LOG, default=False): cv.boolean,
+    vol.Optional(CONF_RESYNC_INTERVAL, default=DEFAULT_RESYNC_INTERVAL): cv.time_period,
     vol.Required(CONF_ZONE): vol.All(cv.ensure_list, [
         {
             vol.Required(CONF_ID): cv.string,
@@ -31,28 +45,54 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     ]),
 })
 
-api_host = ''
-api_url = ''
-
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the HAI Zones"""
 
-    api_host = config[CONF_HOST]
-    api_url = 'https://' + str(api_host) + '/api/zone/'
+    coordinator = async_get_coordinator(hass, config)
+    coordinator.add_zones(zone[CONF_ID] for zone in config[CONF_ZONE])
+
+    # streamed and replayed zone changes are pushed to the entities
+    pushed = config[CONF_STREAM] or config[CONF_EVENT_LOG]
+    if config[CONF_STREAM]:
+        coordinator.async_start_zone_stream(config[CONF_RESYNC_INTERVAL])
+    else:
+        if config[CONF_EVENT_LOG]:
+            coordinator.use_zone_log()
+        coordinator.async_schedule_refresh()
 
     # Add devices
-    add_entities(HAIZone(zone, api_url) for zone in config[CONF_ZONE])
+    async_add_entities(HAIZone(zone, coordinator, pushed) for zone in config[CONF_ZONE])
 
-class HAIZone(BinarySensorEntity):
+class HAIZone(HAIEntity, BinarySensorEntity):
     """Representation of an HAI Zone."""
 
-    def __init__(self, zone, api_url):
+    def __init__(self, zone, coordinator, pushed=False):
         """Initialize an HAI Zone."""
+        super().__init__(coordinator)
         self._name = zone['name']
         self._id = zone['id']
         self._device_class = zone['device_class']
-        self._state = False
-        self._api_url = api_url
+        # unknown until the first fetch
+        self._state = None
+        self._pushed = pushed
+        self._set_state()
+
+    async def async_added_to_hass(self):
+        """Subscribe to coordinator polls and, if enabled, pushed changes."""
+        await super().async_added_to_hass()
+        if self._pushed:
+            self.async_on_remove(async_dispatcher_connect(
+                self.hass, self.coordinator.zone_signal, self._zone_updated))
+            # zones may have been fetched before this entity was added
+            self._set_state()
+
+    @callback
+    def _zone_updated(self, zone_id):
+        """Apply a streamed or replayed zone change (None means all zones)."""
+        if zone_id is not None and zone_id != int(self._id):
+            return
+        self._set_state()
+        self._async_write_if_changed()
 
     @property
     def name(self):
@@ -64,17 +104,11 @@ class HAIZone(BinarySensorEntity):
         """Return true if the zone is on/open."""
         return self._state
 
-    def update(self):
-        """
-        Fetch new state data for this zone.
-        Return true if zone is triggered.
-        """
-
-        try:
-            r = requests.get(self._api_url + str(self._id))
-            current_state = r.json()
-        except:
-            return False
+    def _set_state(self):
+        """Set zone state from the coordinator's copy of this zone."""
+        current_state = self.coordinator.zones.get(int(self._id))
+        if current_state is None:
+            return
 
         if current_state["zone_status"] == "Secure":
             self._state = False
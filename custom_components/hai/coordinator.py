@@ -0,0 +1,450 @@
+"""Shared hai-proxy polling for the HAI light, switch and binary_sensor platforms."""
+
+import asyncio
+import logging
+from datetime import timedelta
+
+import aiohttp
+import voluptuous as vol
+
+import homeassistant.helpers.config_validation as cv
+from homeassistant.const import (
+    CONF_HOST, CONF_SCAN_INTERVAL, EVENT_HOMEASSISTANT_STOP)
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_call_later, async_track_time_interval
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+
+from ..metrics import async_register_metrics
+from ..metrics.stats import Metrics
+from .api import HAIProxy, HAIProxyError, HAIProxyUnavailable
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_HAI = 'hai'
+
+CONF_POOL_SIZE = 'pool_size'
+CONF_CONNECT_TIMEOUT = 'connect_timeout'
+CONF_READ_TIMEOUT = 'read_timeout'
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 10
+
+# Configuration shared by all HAI platforms, applied per hai-proxy host
+HOST_SCHEMA = {
+    vol.Required(CONF_HOST): cv.string,
+    vol.Optional(CONF_POOL_SIZE, default=DEFAULT_POOL_SIZE): cv.positive_int,
+    vol.Optional(CONF_CONNECT_TIMEOUT, default=DEFAULT_CONNECT_TIMEOUT): cv.positive_float,
+    vol.Optional(CONF_READ_TIMEOUT, default=DEFAULT_READ_TIMEOUT): cv.positive_float,
+}
+
+# Poll interval unless a platform of the host sets scan_interval
+SCAN_INTERVAL = timedelta(seconds=30)
+# Poll this often right after a command or a state change ...
+FAST_SCAN_INTERVAL = timedelta(seconds=5)
+# ... and double the interval up to this while nothing changes
+MAX_SCAN_INTERVAL = timedelta(minutes=2)
+
+# Dispatcher signal sent with a zone id, or None for all zones, when zone
+# state changes outside of a poll or is replayed from the zone log.
+# Formatted with the hai-proxy host.
+SIGNAL_ZONE_UPDATE = 'hai_zone_update_{}'
+
+# Seconds to wait before reconnecting a dropped zone change feed
+STREAM_RETRY_DELAY = 10
+
+# Seconds the first refresh of a host waits for its other platforms to be
+# set up, so one fetch serves them all
+FIRST_REFRESH_DELAY = 0.5
+
+
+def async_get_coordinator(hass, config):
+    """Return the coordinator shared by all HAI platforms for a host.
+
+    The first platform set up for a host decides its HOST_SCHEMA options,
+    the smallest scan_interval of its platforms its poll interval.
+    """
+    host = config[CONF_HOST]
+    coordinators = hass.data.setdefault(DATA_HAI, {})
+    if host not in coordinators:
+        coordinator = HAICoordinator(
+            hass, host, config[CONF_POOL_SIZE],
+            aiohttp.ClientTimeout(
+                total=None, sock_connect=config[CONF_CONNECT_TIMEOUT],
+                sock_read=config[CONF_READ_TIMEOUT]))
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, coordinator.async_close)
+        async_register_metrics(hass, coordinator.metrics)
+        coordinators[host] = coordinator
+    if config.get(CONF_SCAN_INTERVAL) is not None:
+        coordinators[host].set_scan_interval(config[CONF_SCAN_INTERVAL])
+    return coordinators[host]
+
+
+class HAICoordinator(DataUpdateCoordinator):
+    """Fetch unit and zone state from one hai-proxy host in bulk."""
+
+    def __init__(self, hass, host, pool_size, timeout):
+        """Initialize the coordinator for a hai-proxy host."""
+        super().__init__(
+            hass, _LOGGER, name='hai ' + str(host),
+            update_interval=SCAN_INTERVAL)
+        self.zone_signal = SIGNAL_ZONE_UPDATE.format(host)
+        # keep-alive connections reused by every poll and command
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size), timeout=timeout)
+        self.metrics = Metrics('hai-proxy ' + str(host))
+        self.api = HAIProxy(self._session, host, metrics=self.metrics)
+        # None until a platform sets scan_interval, which then also caps
+        # the idle backoff
+        self._scan_interval = None
+        # ids of the units and zones of all platforms of the host, fetched
+        # one by one if hai-proxy has no bulk endpoints
+        self._unit_ids = set()
+        self._zone_ids = set()
+        self._stream_task = None
+        self._cancel_resync = None
+        self._zone_log = False
+        # sequence number of the last zone change replayed from the log
+        self._zone_cursor = None
+        # dict unit id -> latest state not yet sent to hai-proxy
+        self._pending_commands = {}
+        # dict unit id -> task sending that unit's pending commands
+        self._command_tasks = {}
+        # dict unit id -> loop time the last command to that unit completed
+        self._command_done = {}
+        self._fetch_started = None
+        self._recent_command = False
+        self._cancel_command_refresh = None
+        # set by async_schedule_refresh until _refresh_task fetches
+        self._refresh_pending = False
+        self._refresh_task = None
+        # dict unit/zone id -> state as returned by hai-proxy
+        self.units = {}
+        self.zones = {}
+        self.metrics.add_gauge(
+            'queued commands', lambda: len(self._pending_commands))
+
+    @property
+    def scan_interval(self):
+        """Return the interval polls back off from and probe at."""
+        return self._scan_interval or SCAN_INTERVAL
+
+    def set_scan_interval(self, scan_interval):
+        """Poll at least every scan_interval, unless a platform set less."""
+        if self._scan_interval is None or scan_interval < self._scan_interval:
+            self._scan_interval = scan_interval
+            self.update_interval = min(self.update_interval, scan_interval)
+
+    def add_units(self, unit_ids):
+        """Include units (lights and switches) in the bulk fetch."""
+        self._unit_ids.update(int(unit_id) for unit_id in unit_ids)
+
+    def add_zones(self, zone_ids):
+        """Include zones in the bulk fetch."""
+        self._zone_ids.update(int(zone_id) for zone_id in zone_ids)
+
+    def _get_units(self):
+        """Fetch the units of the host."""
+        return self.api.get_units(self._unit_ids)
+
+    def _get_zones(self):
+        """Fetch the zones of the host."""
+        return self.api.get_zones(self._zone_ids)
+
+    def use_zone_log(self):
+        """Fetch zones by replaying the hai-proxy zone change log."""
+        self._zone_log = True
+
+    @callback
+    def async_schedule_refresh(self):
+        """Fetch newly added units or zones without waiting for hai-proxy.
+
+        Lets platforms add their entities at once, which show an unknown
+        state until the fetch completes. Platforms asking at about the same
+        time share one fetch; one asking during a fetch gets another after
+        it, instead of a concurrent one.
+        """
+        self._refresh_pending = True
+        if self._refresh_task is None:
+            self._refresh_task = self.hass.async_create_background_task(
+                self._async_refresh_pending(), self.name + ' refresh')
+
+    async def _async_refresh_pending(self):
+        """Refresh until no platform asks for another refresh."""
+        try:
+            await asyncio.sleep(FIRST_REFRESH_DELAY)
+            while self._refresh_pending:
+                self._refresh_pending = False
+                await self.async_refresh()
+        finally:
+            self._refresh_task = None
+
+    def async_send_unit(self, unit_id, state, min_interval=0):
+        """Queue new state for a unit without waiting for hai-proxy.
+
+        Only the latest state queued while a command to the same unit is in
+        flight is sent, at most once every min_interval seconds. A rejected
+        command triggers a refresh so entities drop their optimistic state.
+        """
+        unit_id = int(unit_id)
+        self._pending_commands[unit_id] = state
+        if unit_id not in self._command_tasks:
+            self._command_tasks[unit_id] = self.hass.async_create_task(
+                self._async_drain_commands(unit_id, min_interval))
+
+    async def async_set_units(self, states):
+        """Send new state to several units at once, return id -> accepted.
+
+        Supersedes any command still queued for those units.
+        """
+        for unit_id in states:
+            self._pending_commands.pop(unit_id, None)
+        try:
+            results = await self.api.set_units(states)
+        except HAIProxyError as err:
+            _LOGGER.error("Unable to send batch command: %s", err)
+            results = {unit_id: False for unit_id in states}
+        done = self.hass.loop.time()
+        for unit_id in states:
+            self._command_done[unit_id] = done
+        self._async_schedule_command_refresh()
+        return results
+
+    def unit_settled(self, unit_id):
+        """Return True if the last fetch already reflects all commands."""
+        unit_id = int(unit_id)
+        if unit_id in self._command_tasks:
+            return False
+        done = self._command_done.get(unit_id)
+        return done is None or (self._fetch_started is not None and
+                                done <= self._fetch_started)
+
+    async def _async_drain_commands(self, unit_id, min_interval):
+        """Send queued states for a unit until none is left."""
+        loop = self.hass.loop
+        try:
+            while unit_id in self._pending_commands:
+                last = self._command_done.get(unit_id)
+                if last is not None and loop.time() - last < min_interval:
+                    await asyncio.sleep(min_interval - (loop.time() - last))
+                state = self._pending_commands.pop(unit_id)
+                start = loop.time()
+                try:
+                    accepted = await self.api.set_unit(unit_id, state)
+                except HAIProxyError as err:
+                    _LOGGER.error("Unable to send command to unit %s: %s",
+                                  unit_id, err)
+                    accepted = False
+                self._command_done[unit_id] = loop.time()
+                self.metrics.record(
+                    loop.time() - start, 'unit {}'.format(unit_id),
+                    error=not accepted)
+                if not accepted:
+                    _LOGGER.warning("Unit %s rejected %s", unit_id, state)
+                    await self.async_request_refresh()
+                else:
+                    self._async_schedule_command_refresh()
+        finally:
+            del self._command_tasks[unit_id]
+
+    @callback
+    def _async_schedule_command_refresh(self):
+        """Poll soon after a command, once hai-proxy had time to apply it."""
+        self._recent_command = True
+        if self._cancel_command_refresh is not None:
+            self._cancel_command_refresh()
+
+        @callback
+        def _refresh(now):
+            self._cancel_command_refresh = None
+            self.hass.async_create_task(self.async_request_refresh())
+
+        self._cancel_command_refresh = async_call_later(
+            self.hass, FAST_SCAN_INTERVAL, _refresh)
+
+    async def async_close(self, event=None):
+        """Stop the zone feed and timers and release pooled connections."""
+        self._async_stop_zone_stream()
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._cancel_command_refresh is not None:
+            self._cancel_command_refresh()
+            self._cancel_command_refresh = None
+        await self._session.close()
+
+    async def _async_update_data(self):
+        """Refresh unit and zone state, keeping the last good copy on error.
+
+        Raises UpdateFailed, marking every entity of the host unavailable,
+        while the circuit breaker keeps hai-proxy from being called.
+        """
+        self._fetch_started = self.hass.loop.time()
+        fetches = []
+        if self._unit_ids:
+            fetches.append(self._async_fetch(self._get_units, 'units'))
+        # streamed zones are refreshed by async_resync_zones instead
+        if self._zone_ids and self._stream_task is None:
+            if self._zone_log:
+                fetches.append(self._async_replay_zone_log())
+            else:
+                fetches.append(self._async_fetch(self._get_zones, 'zones'))
+        changed = any(await asyncio.gather(*fetches))
+
+        if self.api.breaker.is_open:
+            # keep probing at the normal rate until hai-proxy recovers
+            self.update_interval = self.scan_interval
+            raise UpdateFailed(self.api.api_url + ' is unavailable')
+
+        # poll fast while things are happening, back off while idle
+        if changed or self._recent_command:
+            self.update_interval = min(FAST_SCAN_INTERVAL, self.scan_interval)
+        else:
+            self.update_interval = min(
+                self.update_interval * 2, self._max_interval())
+        self._recent_command = False
+
+    def _max_interval(self):
+        """Return the longest interval the idle backoff may reach.
+
+        Polled zones have no other way to report a change, so they are never
+        polled less often than the scan interval; neither is anything once
+        a platform sets scan_interval.
+        """
+        if (self._scan_interval is not None or (
+                self._zone_ids and self._stream_task is None and
+                not self._zone_log)):
+            return self.scan_interval
+        return MAX_SCAN_INTERVAL
+
+    async def _async_fetch(self, fetch, attr):
+        """Store the result of one bulk fetch, return True if it changed."""
+        try:
+            result = await fetch()
+        except HAIProxyUnavailable:
+            return False
+        except HAIProxyError as err:
+            _LOGGER.error("Unable to fetch %s from %s: %s",
+                          attr, self.api.api_url, err)
+            return False
+        # None means hai-proxy reported no change since the last fetch
+        if result is None or result == getattr(self, attr):
+            return False
+        setattr(self, attr, result)
+        return True
+
+    async def _async_replay_zone_log(self):
+        """Apply the logged zone changes in order, return True if any.
+
+        Every change is pushed to its zone entity, so a zone that opened and
+        closed since the last fetch still records both. Fetches all zones
+        instead on the first call and whenever the log lost changes.
+        """
+        try:
+            log = await self.api.get_zone_log(self._zone_cursor)
+        except HAIProxyUnavailable:
+            return False
+        except HAIProxyError as err:
+            _LOGGER.error("Unable to fetch the zone log from %s: %s",
+                          self.api.api_url, err)
+            return False
+        if log is None:
+            _LOGGER.warning("%s keeps no zone log, polling zones instead",
+                            self.api.api_url)
+            self._zone_log = False
+            return await self._async_fetch(self._get_zones, 'zones')
+
+        seq, events = log
+        if events is None:
+            try:
+                zones = await self._get_zones()
+            except HAIProxyUnavailable:
+                return False
+            except HAIProxyError as err:
+                _LOGGER.error("Unable to fetch zones from %s: %s",
+                              self.api.api_url, err)
+                return False
+            # changes logged during the fetch are replayed by the next one
+            self._zone_cursor = seq
+            if zones is None or zones == self.zones:
+                return False
+            self.zones = zones
+            return True
+        for zone in events:
+            self.zones[zone['id']] = zone
+            async_dispatcher_send(self.hass, self.zone_signal, zone['id'])
+        if events:
+            self.api.forget_zones()
+        self._zone_cursor = seq
+        return bool(events)
+
+    def async_start_zone_stream(self, resync_interval):
+        """Follow the hai-proxy zone change feed instead of polling zones.
+
+        Zones are still fully refreshed every resync_interval, and after
+        every (re)connect of the feed, to catch any missed changes.
+        """
+        if self._stream_task is not None:
+            return
+        self._stream_task = self.hass.async_create_background_task(
+            self._async_stream_zones(), 'hai zone feed')
+        self._cancel_resync = async_track_time_interval(
+            self.hass, self.async_resync_zones, resync_interval)
+
+    @callback
+    def _async_stop_zone_stream(self):
+        """Stop following the zone feed, so polls fetch zones again."""
+        if self._cancel_resync is not None:
+            self._cancel_resync()
+            self._cancel_resync = None
+        if self._stream_task is not None:
+            self._stream_task.cancel()
+            self._stream_task = None
+
+    async def async_resync_zones(self, now=None):
+        """Fetch all zones and notify zone entities."""
+        try:
+            zones = await self._get_zones()
+        except HAIProxyUnavailable:
+            return
+        except HAIProxyError as err:
+            _LOGGER.error("Unable to resync zones from %s: %s",
+                          self.api.api_url, err)
+            return
+        if zones is None:
+            return
+        self.zones = zones
+        async_dispatcher_send(self.hass, self.zone_signal, None)
+
+    async def _async_stream_zones(self):
+        """Apply zone changes from the server-sent event feed.
+
+        Runs until stopped, or falls back to polling zones if hai-proxy
+        has no zone feed.
+        """
+        while True:
+            try:
+                async for zone in self.api.zone_events():
+                    if zone is None:
+                        self.hass.async_create_task(self.async_resync_zones())
+                        continue
+                    self.zones[zone['id']] = zone
+                    self.api.forget_zones()
+                    async_dispatcher_send(
+                        self.hass, self.zone_signal, zone['id'])
+            except HAIProxyUnavailable:
+                pass
+            except HAIProxyError as err:
+                _LOGGER.warning(
+                    "Zone feed from %s lost (%s), reconnecting in %s s",
+                    self.api.api_url, err, STREAM_RETRY_DELAY)
+            else:
+                # the feed only ends without an error if there is none
+                _LOGGER.warning("%s has no zone feed, polling zones instead",
+                                self.api.api_url)
+                self._stream_task = None
+                self._async_stop_zone_stream()
+                await self.async_request_refresh()
+                return
+            await asyncio.sleep(STREAM_RETRY_DELAY)
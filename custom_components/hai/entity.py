@@ -0,0 +1,28 @@
+"""Base class of the HAI entities."""
+
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from ..entity_state.entity import WriteIfChangedMixin
+
+
+class HAIEntity(WriteIfChangedMixin, CoordinatorEntity):
+    """Entity fed by a HAICoordinator that only writes changed state.
+
+    Subclasses set their state from the coordinator in _set_state() and
+    return what Home Assistant shows of it from _compact_state().
+    """
+
+    def _set_state(self):
+        """Set the entity state from the coordinator's data."""
+        raise NotImplementedError
+
+    def _compact_state(self):
+        """Return a compact copy of the state Home Assistant shows."""
+        return (self.available, self.is_on)
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Apply the latest bulk fetch from the coordinator."""
+        self._set_state()
+        self._async_write_if_changed()
@@ -3,20 +3,25 @@
 
 import logging
 
-import requests, json
 import voluptuous as vol
 
 import homeassistant.helpers.config_validation as cv
 # Import the device class from the component that you want to support
 from homeassistant.components.light import (
     ATTR_BRIGHTNESS, PLATFORM_SCHEMA, LightEntity, LightEntityFeature, ColorMode)
-from homeassistant.const import CONF_HOST, CONF_DEVICES, CONF_ID, CONF_NAME
+from homeassistant.const import CONF_DEVICES, CONF_ID, CONF_NAME
+from .coordinator import HOST_SCHEMA, async_get_coordinator
+from .entity import HAIEntity
+from .services import async_setup_services
 
 _LOGGER = logging.getLogger(__name__)
 
+CONF_COMMAND_INTERVAL = 'command_interval'
+
 # Validation of the user's configuration
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
-    vol.Required(CONF_HOST): cv.string,
+    **HOST_SCHEMA,
+    vol.Optional(CONF_COMMAND_INTERVAL, default=0): cv.positive_float,
     vol.Required(CONF_DEVICES): vol.All(cv.ensure_list, [
         {
             vol.Required(CONF_ID): cv.string,
@@ -26,29 +31,33 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     ]),
 })
 
-api_host = ''
-api_url = ''
-
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the HAI Light platform."""
 
-    api_host = config[CONF_HOST]
-    api_url = 'https://' + str(api_host) + '/api/light/'
+    coordinator = async_get_coordinator(hass, config)
+    coordinator.add_units(light[CONF_ID] for light in config[CONF_DEVICES])
+    coordinator.async_schedule_refresh()
+    async_setup_services(hass)
 
     # Add devices
-    add_entities(HAILight(light, api_url) for light in config[CONF_DEVICES])
+    async_add_entities(
+        HAILight(light, coordinator, config[CONF_COMMAND_INTERVAL])
+        for light in config[CONF_DEVICES])
 
-class HAILight(LightEntity):
+class HAILight(HAIEntity, LightEntity):
     """Representation of an HAI Light."""
 
-    def __init__(self, light, api_url):
+    def __init__(self, light, coordinator, command_interval=0):
         """Initialize an HAI Light."""
+        super().__init__(coordinator)
         self._name = light['name']
         self._id = light['id']
-        self._state = False
+        # unknown until the first fetch
+        self._state = None
         self._brightness = 0
-        self._api_url = api_url
         self._isDimmer = light.get('is_dimmer', False)
+        self._command_interval = command_interval
+        self._set_state()
 
     @property
     def name(self):
@@ -89,49 +98,45 @@ class HAILight(LightEntity):
         return ColorMode.ONOFF
 
 
-    def turn_on(self, **kwargs):
+    async def async_turn_on(self, **kwargs):
         """Instruct the light to turn on.
 
         You can skip the brightness part if your light does not support
         brightness control.
         """
 
-        # snapshot current brightness before attempting to update
-        prev_brightness = self._brightness
-
+        # show the new state right away, the next poll reconciles it
+        self._state = True
         if ATTR_BRIGHTNESS in kwargs:
             self._brightness = kwargs[ATTR_BRIGHTNESS]
             # scale from 1-255 to 1-99
             hai_level = int((self._brightness / 255)*100)
-            r = requests.put(self._api_url + str(self._id), json={'is_on':True, 'brightness_level':hai_level})
-            if r.status_code == 202:
-                self._state = True
-            else:
-                self._brightness = prev_brightness
+            self.coordinator.async_send_unit(
+                self._id, {'is_on':True, 'brightness_level':hai_level},
+                self._command_interval)
         else:
-            r = requests.put(self._api_url + str(self._id), json={'is_on':True})
-            if r.status_code == 202:
-                self._state = True
+            self.coordinator.async_send_unit(
+                self._id, {'is_on':True}, self._command_interval)
+        self.async_write_ha_state()
 
-    def turn_off(self, **kwargs):
+    async def async_turn_off(self, **kwargs):
         """Instruct the light to turn off."""
 
-        r = requests.put(self._api_url + str(self._id), json={'is_on':False})
-        if r.status_code == 202:
-            self._state = False
-
-
-    def update(self):
-        """Fetch new state data for this light.
-
-        This is the only method that should fetch new data for Home Assistant.
-        """
-
-        try:
-            r = requests.get(self._api_url + str(self._id))
-            current_state = r.json()
-        except:
-            return False
+        self._state = False
+        self.coordinator.async_send_unit(
+            self._id, {'is_on':False}, self._command_interval)
+        self.async_write_ha_state()
+
+    def _compact_state(self):
+        """Return a compact copy of the state Home Assistant shows."""
+        return (self.available, self._state, self._brightness)
+
+    def _set_state(self):
+        """Set light state from the coordinator's copy of this unit."""
+        current_state = self.coordinator.units.get(int(self._id))
+        # keep optimistic state until a poll has seen the last command
+        if current_state is None or not self.coordinator.unit_settled(self._id):
+            return
 
         self._state = current_state["is_on"]
         # light is currently dimmed
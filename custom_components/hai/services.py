@@ -0,0 +1,64 @@
+"""Services of the HAI integration."""
+
+import voluptuous as vol
+
+import homeassistant.helpers.config_validation as cv
+from homeassistant.components.light import ATTR_BRIGHTNESS
+from homeassistant.const import ATTR_STATE, CONF_HOST, CONF_ID
+from homeassistant.core import SupportsResponse, callback
+from homeassistant.exceptions import HomeAssistantError
+
+from .coordinator import DATA_HAI
+
+DOMAIN = 'hai'
+
+SERVICE_SET_UNITS = 'set_units'
+
+ATTR_UNITS = 'units'
+
+SET_UNITS_SCHEMA = vol.Schema({
+    vol.Optional(CONF_HOST): cv.string,
+    vol.Required(ATTR_UNITS): vol.All(cv.ensure_list, [
+        {
+            vol.Required(CONF_ID): vol.All(vol.Coerce(int), vol.Range(min=1, max=255)),
+            vol.Required(ATTR_STATE): cv.boolean,
+            vol.Optional(ATTR_BRIGHTNESS): vol.All(vol.Coerce(int), vol.Range(min=0, max=255)),
+        }
+    ]),
+})
+
+
+@callback
+def async_setup_services(hass):
+    """Register the HAI services once for all platforms."""
+    if hass.services.has_service(DOMAIN, SERVICE_SET_UNITS):
+        return
+
+    async def async_set_units(service):
+        """Set many units in as few requests as possible."""
+        coordinators = hass.data.get(DATA_HAI, {})
+        host = service.data.get(CONF_HOST)
+        if host is not None:
+            coordinator = coordinators.get(host)
+        elif len(coordinators) == 1:
+            coordinator = next(iter(coordinators.values()))
+        else:
+            coordinator = None
+        if coordinator is None:
+            raise HomeAssistantError("Unknown or ambiguous hai-proxy host")
+
+        states = {}
+        for unit in service.data[ATTR_UNITS]:
+            state = {'is_on': unit[ATTR_STATE]}
+            if unit[ATTR_STATE] and ATTR_BRIGHTNESS in unit:
+                # scale from 1-255 to 1-99
+                state['brightness_level'] = int((unit[ATTR_BRIGHTNESS] / 255)*100)
+            states[unit[CONF_ID]] = state
+
+        results = await coordinator.async_set_units(states)
+        return {ATTR_UNITS: {str(unit_id): accepted
+                             for unit_id, accepted in results.items()}}
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_SET_UNITS, async_set_units, schema=SET_UNITS_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL)
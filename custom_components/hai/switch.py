@@ -2,20 +2,22 @@
 
 import logging
 
-import requests, json
 import voluptuous as vol
 
 import homeassistant.helpers.config_validation as cv
 # Import the device class from the component that you want to support
 from homeassistant.components.switch import (
     PLATFORM_SCHEMA, SwitchEntity)
-from homeassistant.const import CONF_HOST, CONF_DEVICES, CONF_ID, CONF_NAME
+from homeassistant.const import CONF_DEVICES, CONF_ID, CONF_NAME
+from .coordinator import HOST_SCHEMA, async_get_coordinator
+from .entity import HAIEntity
+from .services import async_setup_services
 
 _LOGGER = logging.getLogger(__name__)
 
 # Validation of the user's configuration
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
-    vol.Required(CONF_HOST): cv.string,
+    **HOST_SCHEMA,
     vol.Required(CONF_DEVICES): vol.All(cv.ensure_list, [
         {
             vol.Required(CONF_ID): cv.string,
@@ -24,28 +26,29 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     ]),
 })
 
-api_host = ''
-api_url = ''
-
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the HAI Switch platform."""
 
-    api_host = config[CONF_HOST]
-    # using the light REST API endpoint because the HAI commands are the same
-    api_url = 'https://' + str(api_host) + '/api/light/'
+    # switches share the light REST API endpoint because the HAI commands are the same
+    coordinator = async_get_coordinator(hass, config)
+    coordinator.add_units(switch[CONF_ID] for switch in config[CONF_DEVICES])
+    coordinator.async_schedule_refresh()
+    async_setup_services(hass)
 
     # Add devices
-    add_entities(HAISwitch(switch, api_url) for switch in config[CONF_DEVICES])
+    async_add_entities(HAISwitch(switch, coordinator) for switch in config[CONF_DEVICES])
 
-class HAISwitch(SwitchEntity):
+class HAISwitch(HAIEntity, SwitchEntity):
     """Representation of an HAI Switch."""
 
-    def __init__(self, switch, api_url):
+    def __init__(self, switch, coordinator):
         """Initialize an HAI Switch."""
+        super().__init__(coordinator)
         self._name = switch['name']
         self._id = switch['id']
-        self._state = False
-        self._api_url = api_url
+        # unknown until the first fetch
+        self._state = None
+        self._set_state()
 
     @property
     def name(self):
@@ -62,30 +65,26 @@ class HAISwitch(SwitchEntity):
         """Return the icon to use in the frontend, if any."""
         return "mdi:toggle-switch"
 
-    def turn_on(self, **kwargs):
+    async def async_turn_on(self, **kwargs):
         """Turn the switch on."""
 
-        r = requests.put(self._api_url + str(self._id), json={'is_on':True})
-        if r.status_code == 202:
-            self._state = True
+        # show the new state right away, the next poll reconciles it
+        self._state = True
+        self.coordinator.async_send_unit(self._id, {'is_on':True})
+        self.async_write_ha_state()
 
-    def turn_off(self, **kwargs):
+    async def async_turn_off(self, **kwargs):
         """Turn the switch off."""
 
-        r = requests.put(self._api_url + str(self._id), json={'is_on':False})
-        if r.status_code == 202:
-            self._state = False
-
-    def update(self):
-        """Fetch new state data for this switch.
-
-        This is the only method that should fetch new data for Home Assistant.
-        """
-
-        try:
-            r = requests.get(self._api_url + str(self._id))
-            current_state = r.json()
-        except:
-            return False
+        self._state = False
+        self.coordinator.async_send_unit(self._id, {'is_on':False})
+        self.async_write_ha_state()
+
+    def _set_state(self):
+        """Set switch state from the coordinator's copy of this unit."""
+        current_state = self.coordinator.units.get(int(self._id))
+        # keep optimistic state until a poll has seen the last command
+        if current_state is None or not self.coordinator.unit_settled(self._id):
+            return
 
         self._state = current_state["is_on"]
@@ -0,0 +1,131 @@
+"""Asyncio TCP connection to the serial port of a Global Cache iTach IP2SL."""
+
+import asyncio
+import logging
+import socket
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# The IP2SL passes bytes sent to this port straight to its RS-232 port
+DEFAULT_PORT = 4999
+
+DEFAULT_TERMINATOR = b'\r\n'
+
+# Seconds before retrying a failed connect, doubled after every failed
+# attempt up to RECONNECT_MAX_DELAY
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+class IP2SLConnection:
+    """Stream of frames to and from the serial device behind an IP2SL.
+
+    Incoming bytes are split into frames on terminator. Only one coroutine
+    may read at a time, so a connection should have a single owner, e.g. a
+    gateway task, that serializes the requests to its device.
+
+    ensure_connected() reopens a lost connection with exponential backoff;
+    between attempts it fails fast instead of waiting for a timeout.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, timeout=3,
+                 terminator=DEFAULT_TERMINATOR):
+        """Initialize the connection without connecting."""
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._terminator = terminator
+        self._reader = None
+        self._writer = None
+        self._retry_delay = RECONNECT_MIN_DELAY
+        self._next_attempt = 0
+
+    @property
+    def connected(self):
+        """Return True if the connection is open."""
+        return self._writer is not None
+
+    async def connect(self):
+        """Open the connection, raising OSError on failure."""
+        self.close()
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self._host, self._port),
+                self._timeout)
+        except asyncio.TimeoutError:
+            raise OSError('timed out connecting to %s' % self._host) from None
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            # notice a gateway that went away without closing the connection
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    async def ensure_connected(self):
+        """Return True if the connection is open, reopening it if needed.
+
+        Returns False at once while the backoff delay after a failed attempt
+        has not passed yet.
+        """
+        if self._writer is not None:
+            return True
+        now = time.monotonic()
+        if now < self._next_attempt:
+            return False
+        try:
+            await self.connect()
+        except OSError as err:
+            if self._retry_delay == RECONNECT_MIN_DELAY:
+                _LOGGER.error("Error connecting to iTach IP2SL %s: %s",
+                              self._host, err)
+            self._next_attempt = now + self._retry_delay
+            self._retry_delay = min(RECONNECT_MAX_DELAY, self._retry_delay * 2)
+            return False
+        if self._retry_delay != RECONNECT_MIN_DELAY:
+            _LOGGER.info("Reconnected to iTach IP2SL %s", self._host)
+        self._retry_delay = RECONNECT_MIN_DELAY
+        return True
+
+    def close(self):
+        """Close the connection."""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def write(self, data):
+        """Send bytes to the serial device, raising OSError on failure."""
+        if self._writer is None:
+            raise OSError('not connected to %s' % self._host)
+        try:
+            self._writer.write(data)
+            await asyncio.wait_for(self._writer.drain(), self._timeout)
+        except asyncio.TimeoutError:
+            self.close()
+            raise OSError('timed out writing to %s' % self._host) from None
+        except OSError:
+            self.close()
+            raise
+
+    async def read_frame(self, timeout=None):
+        """Return the next frame without its terminator.
+
+        Returns None if no complete frame arrives within timeout seconds,
+        leaving a partial frame for the next call. Raises OSError, and closes
+        the connection, if it fails or is closed by the gateway.
+        """
+        if self._reader is None:
+            raise OSError('not connected to %s' % self._host)
+        try:
+            frame = await asyncio.wait_for(
+                self._reader.readuntil(self._terminator), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except asyncio.IncompleteReadError:
+            self.close()
+            raise OSError('connection closed by %s' % self._host) from None
+        except asyncio.LimitOverrunError:
+            self.close()
+            raise OSError('no terminator from %s' % self._host) from None
+        except OSError:
+            self.close()
+            raise
+        return frame[:-len(self._terminator)]
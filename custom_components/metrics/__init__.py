@@ -0,0 +1,51 @@
+"""Request metrics of the hai, nuvo and benq gateways.
+
+The platforms always count requests; adding `metrics:` to the configuration
+shows the figures as diagnostic sensors and adds the metrics.dump service.
+"""
+
+import homeassistant.helpers.config_validation as cv
+from homeassistant.const import Platform
+from homeassistant.core import SupportsResponse, callback
+from homeassistant.helpers.discovery import async_load_platform
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+
+DOMAIN = 'metrics'
+
+DATA_METRICS = 'metrics'
+
+# Dispatcher signal sent with the Metrics of a gateway registered after the
+# sensors were set up
+SIGNAL_METRICS_ADDED = 'metrics_added'
+
+SERVICE_DUMP = 'dump'
+
+CONFIG_SCHEMA = cv.empty_config_schema(DOMAIN)
+
+
+@callback
+def async_register_metrics(hass, metrics):
+    """Show the Metrics of a gateway, once its gauges are added."""
+    registered = hass.data.setdefault(DATA_METRICS, {})
+    if metrics.name in registered:
+        return
+    registered[metrics.name] = metrics
+    async_dispatcher_send(hass, SIGNAL_METRICS_ADDED, metrics)
+
+
+async def async_setup(hass, config):
+    """Set up the metrics sensors and the dump service."""
+    hass.data.setdefault(DATA_METRICS, {})
+
+    async def async_dump(service):
+        """Return the figures of every gateway and its entities."""
+        return {name: metrics.as_dict() for name, metrics
+                in sorted(hass.data[DATA_METRICS].items())}
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_DUMP, async_dump,
+        supports_response=SupportsResponse.ONLY)
+
+    hass.async_create_task(
+        async_load_platform(hass, Platform.SENSOR, DOMAIN, {}, config))
+    return True
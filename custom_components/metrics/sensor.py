@@ -0,0 +1,76 @@
+"""Diagnostic sensors showing the request metrics of each gateway."""
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass, SensorEntity, SensorStateClass)
+from homeassistant.const import EntityCategory, UnitOfTime
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+
+from . import DATA_METRICS, SIGNAL_METRICS_ADDED
+
+# Gateway figures shown as sensors: key -> (name, value(stats), is latency)
+GATEWAY_SENSORS = {
+    'requests': ('Requests', lambda stats: stats.requests, False),
+    'errors': ('Errors', lambda stats: stats.errors, False),
+    'timeouts': ('Timeouts', lambda stats: stats.timeouts, False),
+    'latency_p50': ('Latency p50', lambda stats: stats.percentile(0.5), True),
+    'latency_p95': ('Latency p95', lambda stats: stats.percentile(0.95), True),
+}
+
+
+async def async_setup_platform(hass, config, async_add_entities,
+                               discovery_info=None):
+    """Add the sensors of every gateway, now and once it is set up."""
+    if discovery_info is None:
+        return
+
+    @callback
+    def async_add_metrics(metrics):
+        """Add the sensors of one gateway."""
+        entities = [GatewaySensor(metrics, key) for key in GATEWAY_SENSORS]
+        entities.extend(GaugeSensor(metrics, name) for name in metrics.gauges)
+        async_add_entities(entities)
+
+    for metrics in hass.data[DATA_METRICS].values():
+        async_add_metrics(metrics)
+    async_dispatcher_connect(hass, SIGNAL_METRICS_ADDED, async_add_metrics)
+
+
+class GatewaySensor(SensorEntity):
+    """A request counter or latency percentile of a gateway."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, metrics, key):
+        """Initialize the sensor."""
+        self._metrics = metrics
+        name, self._value, latency = GATEWAY_SENSORS[key]
+        self._attr_name = '{} {}'.format(metrics.name, name)
+        if latency:
+            self._attr_device_class = SensorDeviceClass.DURATION
+            self._attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+        else:
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    @property
+    def native_value(self):
+        """Return the current figure."""
+        return self._value(self._metrics.gateway)
+
+
+class GaugeSensor(SensorEntity):
+    """A gauge of a gateway, e.g. the number of queued commands."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, metrics, name):
+        """Initialize the sensor."""
+        self._value = metrics.gauges[name]
+        self._attr_name = '{} {}'.format(metrics.name, name)
+
+    @property
+    def native_value(self):
+        """Return the current value."""
+        return self._value()
@@ -0,0 +1,102 @@
+"""Request counters and latency histograms."""
+
+# Upper bounds in milliseconds of the latency histogram buckets; a last
+# bucket counts everything slower
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class RequestStats:
+    """Count requests, errors and timeouts, and histogram their latency."""
+
+    def __init__(self):
+        """Initialize empty counters."""
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        # milliseconds
+        self.latency_max = 0.0
+
+    def record(self, latency, error=False, timeout=False):
+        """Count a request that took latency seconds."""
+        latency *= 1000
+        self.requests += 1
+        if timeout:
+            self.timeouts += 1
+        elif error:
+            self.errors += 1
+        index = next((index for index, bound in enumerate(LATENCY_BUCKETS)
+                      if latency <= bound), len(LATENCY_BUCKETS))
+        self.buckets[index] += 1
+        self.latency_max = max(self.latency_max, latency)
+
+    def percentile(self, fraction):
+        """Return the latency in ms fraction of the requests stayed under.
+
+        Interpolated within its histogram bucket and capped at the slowest
+        request, None before any request.
+        """
+        if not self.requests:
+            return None
+        rank = fraction * self.requests
+        lower = count = 0
+        for bound, number in zip(LATENCY_BUCKETS, self.buckets):
+            if number and count + number >= rank:
+                latency = lower + (bound - lower) * (rank - count) / number
+                return round(min(latency, self.latency_max), 1)
+            count += number
+            lower = bound
+        return round(self.latency_max, 1)
+
+    def as_dict(self):
+        """Return the counters and the histogram, e.g. for a dump."""
+        bounds = ['<=%d ms' % bound for bound in LATENCY_BUCKETS]
+        bounds.append('>%d ms' % LATENCY_BUCKETS[-1])
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'latency_p50': self.percentile(0.5),
+            'latency_p95': self.percentile(0.95),
+            'latency_max': round(self.latency_max, 1),
+            'histogram': dict(zip(bounds, self.buckets)),
+        }
+
+
+class Metrics:
+    """Request statistics of one gateway and of the entities using it.
+
+    The gateway figures time the exchanges with the device, the figures of an
+    entity the whole wait of its requests, including any queueing. Gauges
+    report a current value, e.g. the number of queued commands.
+    """
+
+    def __init__(self, name):
+        """Initialize the metrics of a gateway."""
+        self.name = name
+        self.gateway = RequestStats()
+        # dict entity name -> RequestStats
+        self.entities = {}
+        # dict gauge name -> function returning its value
+        self.gauges = {}
+
+    def add_gauge(self, name, value):
+        """Report value() as a gauge."""
+        self.gauges[name] = value
+
+    def record(self, latency, entity=None, error=False, timeout=False):
+        """Count a request of an entity, or of the gateway if None."""
+        if entity is None:
+            stats = self.gateway
+        else:
+            stats = self.entities.setdefault(entity, RequestStats())
+        stats.record(latency, error, timeout)
+
+    def as_dict(self):
+        """Return all figures, e.g. for a dump."""
+        return {
+            'gateway': self.gateway.as_dict(),
+            'gauges': {name: value() for name, value in self.gauges.items()},
+            'entities': {name: stats.as_dict()
+                         for name, stats in sorted(self.entities.items())},
+        }
@@ -0,0 +1,312 @@
+"""Serialized, prioritized access to the Nuvo amplifier's serial link."""
+
+import asyncio
+import itertools
+import logging
+import time
+
+from .protocol import REPLY_ERROR, STATUS_FRAMES, ZoneStatus, parse_frame
+
+_LOGGER = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_COMMAND = 0
+PRIORITY_POLL = 1
+
+# Wakes the worker without a command, e.g. to reconnect
+_PRIORITY_WAKE = -1
+
+# Seconds a caller waits for its turn plus the answer
+DEFAULT_QUEUE_TIMEOUT = 15
+
+# Seconds to wait for the reply to a command
+REPLY_TIMEOUT = 1
+
+# Seconds without anything received before the link is checked with a
+# status query
+HEALTH_CHECK_INTERVAL = 60
+
+# Commands in a row without a reply after which the connection is reopened
+MAX_MISSED_REPLIES = 2
+
+
+class NuvoGateway:
+    """Own the IP2SL connection of one amplifier.
+
+    Entities await send(); a worker task sends one command at a time, user
+    commands ahead of queued status polls, and hands each caller the status
+    that answers its command. A reader task reads every line the amplifier
+    sends, and passes status nobody asked for (e.g. after a keypad change)
+    to the listener of that zone.
+
+    Commands sent with a coalesce key replace a queued command with the same
+    key, so a slider drag only sends the latest volume. A connection that
+    fails, or stops answering, is reopened with backoff; until then send()
+    fails fast.
+
+    Every exchange is counted in metrics, if given, along with the number
+    of queued commands.
+    """
+
+    def __init__(self, connection, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 metrics=None):
+        """Initialize the gateway, start() runs it."""
+        self._connection = connection
+        self._queue_timeout = queue_timeout
+        self._queue = asyncio.PriorityQueue()
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.add_gauge('queued commands', self._queue.qsize)
+        # keeps commands of equal priority in FIFO order
+        self._sequence = itertools.count()
+        # dict coalesce key -> [frame, future, waiters] of a command not yet
+        # sent; waiters counts the callers sharing its future
+        self._coalesced = {}
+        # (zone id, future) of the command waiting for its reply
+        self._pending = None
+        # dict zone id -> callback(status)
+        self._listeners = {}
+        # callbacks(connected)
+        self._connection_listeners = []
+        self._connected = connection.connected
+        self._missed = 0
+        self._last_received = time.monotonic()
+        self._worker = None
+        self._reader = None
+        # a cancelled wait_for can still return, so the worker also checks
+        self._stopping = False
+
+    def add_listener(self, zone_id, listener):
+        """Call listener(status) with unsolicited ZoneStatus of a zone.
+
+        Returns a function that removes the listener.
+        """
+        self._listeners[zone_id] = listener
+        return lambda: self._listeners.pop(zone_id, None)
+
+    def add_connection_listener(self, listener):
+        """Call listener(connected) when the connection is lost or restored.
+
+        Returns a function that removes the listener.
+        """
+        self._connection_listeners.append(listener)
+        return lambda: self._connection_listeners.remove(listener)
+
+    @property
+    def available(self):
+        """Return True if the amplifier is connected."""
+        return self._connected
+
+    def start(self):
+        """Start the worker, from within the event loop."""
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def async_stop(self, event=None):
+        """Stop the gateway and close the connection."""
+        self._stopping = True
+        self._connected = False
+        self._connection_listeners.clear()
+        for task in (self._worker, self._reader):
+            if task is not None:
+                task.cancel()
+        self._connection.close()
+
+    async def send(self, frame, zone_id, priority=PRIORITY_COMMAND,
+                   coalesce=None):
+        """Send a command frame and return the ZoneStatus answering it.
+
+        The reply is the status of zone_id, or an all zones off status.
+        If a command with the same coalesce key is still queued, its frame is
+        replaced and both callers get the reply to the latest one.
+        Returns None if no reply was received, at once while disconnected.
+        """
+        if not self._connected:
+            return None
+        return await self._result(
+            self._submit(frame, zone_id, priority, coalesce))
+
+    async def send_batch(self, commands, priority=PRIORITY_COMMAND):
+        """Queue (frame, zone_id) commands at once and return their replies.
+
+        The commands are sent back to back, replies are returned in the same
+        order as the commands, None for a command that got no reply.
+        """
+        if not self._connected:
+            return [None] * len(commands)
+        queued = [self._submit(frame, zone_id, priority, None)
+                  for frame, zone_id in commands]
+        return [await self._result(command) for command in queued]
+
+    def _submit(self, frame, zone_id, priority, coalesce):
+        """Queue a command and return it, to wait for with _result()."""
+        command = self._coalesced.get(coalesce)
+        if command is not None and not command[1].done():
+            command[0] = frame
+            command[2] += 1
+            return command
+        command = [frame, asyncio.get_running_loop().create_future(), 1]
+        if coalesce is not None:
+            self._coalesced[coalesce] = command
+        self._queue.put_nowait(
+            (priority, next(self._sequence), command, zone_id, coalesce))
+        return command
+
+    async def _result(self, command):
+        """Wait for the reply to a queued command."""
+        future = command[1]
+        done, _ = await asyncio.wait({future}, timeout=self._queue_timeout)
+        if not done:
+            _LOGGER.error("Timed out waiting for the Nuvo serial link")
+            command[2] -= 1
+            # drop the command if nobody else waits for it and the worker
+            # has not picked it up yet
+            if not command[2]:
+                future.cancel()
+            return None
+        if future.cancelled():
+            return None
+        return future.result()
+
+    async def _run(self):
+        """Send queued commands one at a time until stopped."""
+        while not self._stopping:
+            if not await self._ensure_connected():
+                await asyncio.sleep(1)
+                continue
+            try:
+                _, _, command, zone_id, coalesce = await asyncio.wait_for(
+                    self._queue.get(), HEALTH_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                await self._health_check()
+                continue
+            if command is None:
+                continue
+            if coalesce is not None:
+                self._coalesced.pop(coalesce, None)
+            frame, future, _ = command
+            if future.done():
+                continue
+            status = await self._exchange(frame, zone_id)
+            if not future.done():
+                future.set_result(status)
+
+    async def _ensure_connected(self):
+        """Reopen a lost connection once its backoff delay has passed."""
+        if not self._connection.connected:
+            if not await self._connection.ensure_connected():
+                return False
+            self._missed = 0
+            self._last_received = time.monotonic()
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.ensure_future(self._read())
+        self._set_connected(True)
+        return True
+
+    def _connection_lost(self, reason):
+        """Close a failed connection so the worker reopens it."""
+        if not self._connected:
+            return
+        _LOGGER.error("Lost connection to Nuvo amplifier: %s", reason)
+        self._connection.close()
+        if self._reader is not asyncio.current_task():
+            self._reader.cancel()
+        self._set_connected(False)
+        # fail the command waiting for a reply and every queued command,
+        # whose callers would otherwise wait for the queue timeout
+        if self._pending is not None and not self._pending[1].done():
+            self._pending[1].set_result(None)
+        while not self._queue.empty():
+            command = self._queue.get_nowait()[2]
+            if command is not None and not command[1].done():
+                command[1].set_result(None)
+        self._coalesced.clear()
+        # wake the worker to reconnect
+        self._queue.put_nowait(
+            (_PRIORITY_WAKE, next(self._sequence), None, None, None))
+
+    def _set_connected(self, connected):
+        """Tell the connection listeners about a change."""
+        if connected == self._connected:
+            return
+        self._connected = connected
+        for listener in list(self._connection_listeners):
+            listener(connected)
+
+    async def _health_check(self):
+        """Make a quiet amplifier answer something, to notice it is gone."""
+        if time.monotonic() - self._last_received < HEALTH_CHECK_INTERVAL:
+            return
+        zone_id = min(self._listeners, default=1)
+        status = await self._exchange(STATUS_FRAMES[zone_id], zone_id)
+        if status is not None:
+            self._dispatch(status)
+
+    async def _exchange(self, frame, zone_id):
+        """Write a command and wait for the reader to receive its reply."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending = (zone_id, future)
+        start = time.monotonic()
+        try:
+            try:
+                await self._connection.write(frame)
+            except OSError as err:
+                self._connection_lost(err)
+                self._record(start, error=True)
+                return None
+            try:
+                status = await asyncio.wait_for(future, REPLY_TIMEOUT)
+            except asyncio.TimeoutError:
+                self._record(start, timeout=True)
+                self._missed += 1
+                if self._missed >= MAX_MISSED_REPLIES:
+                    self._connection_lost(
+                        'no reply to %d commands' % self._missed)
+                return None
+            # None if the amplifier rejected the command or went away
+            self._record(start, error=status is None)
+            return status
+        finally:
+            self._pending = None
+
+    def _record(self, start, **kwargs):
+        """Count an exchange that started at start in the metrics."""
+        if self._metrics is not None:
+            self._metrics.record(time.monotonic() - start, **kwargs)
+
+    async def _read(self):
+        """Read every line the amplifier sends until the connection fails."""
+        while True:
+            try:
+                frame = await self._connection.read_frame()
+            except OSError as err:
+                self._connection_lost(err)
+                return
+            self._missed = 0
+            self._last_received = time.monotonic()
+            record = parse_frame(frame)
+            if record is None:
+                continue
+            if self._pending is not None and not self._pending[1].done():
+                zone_id, future = self._pending
+                if isinstance(record, ZoneStatus) and (
+                        record.zone is None or record.zone == zone_id):
+                    future.set_result(record)
+                    continue
+                if record == REPLY_ERROR:
+                    _LOGGER.error("Nuvo amplifier rejected a command")
+                    future.set_result(None)
+                    continue
+            self._dispatch(record)
+
+    def _dispatch(self, record):
+        """Pass status nobody asked for to its zone's listener."""
+        _LOGGER.debug("Unsolicited: %s", record)
+        if not isinstance(record, ZoneStatus):
+            return
+        if record.zone is None:
+            listeners = list(self._listeners.values())
+        else:
+            listener = self._listeners.get(record.zone)
+            listeners = [listener] if listener else []
+        for listener in listeners:
+            listener(record)
@@ -2,21 +2,33 @@
 Support for Nuvo Essentia E6G amplifiers via Global Cache IP2SL.
 
 """
+import asyncio
 import logging
-import codecs
-import re
+import time
+from datetime import timedelta
 
 import voluptuous as vol
 
 from homeassistant.components.media_player import (
     MediaPlayerEntity, PLATFORM_SCHEMA)
 from homeassistant.components.media_player.const import (
+    ATTR_INPUT_SOURCE, ATTR_MEDIA_VOLUME_LEVEL, ATTR_MEDIA_VOLUME_MUTED,
     MediaPlayerEntityFeature, DOMAIN)
 from homeassistant.const import (
-    ATTR_ENTITY_ID, CONF_NAME, CONF_PORT, CONF_HOST, STATE_OFF, STATE_ON)
+    ATTR_ENTITY_ID, ATTR_STATE, CONF_NAME, CONF_PORT, CONF_HOST, CONF_SCAN_INTERVAL,
+    EVENT_HOMEASSISTANT_STOP, STATE_OFF, STATE_ON)
+from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.event import async_track_time_interval
 
-REQUIREMENTS = ['pyitachip2sl==0.1']
+from ..entity_state.entity import WriteIfChangedMixin
+from ..ip2sl.connection import IP2SLConnection
+from ..metrics import async_register_metrics
+from ..metrics.stats import Metrics
+from .gateway import NuvoGateway, PRIORITY_POLL
+from .protocol import (
+    ALL_OFF_FRAME, MAX_VOLUME, MUTE_FRAMES, OFF_FRAMES, ON_FRAMES, SOURCE_FRAMES,
+    STATUS_FRAMES, TERMINATOR, VOLUME_FRAMES, ZoneStatus)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -39,55 +51,93 @@ SOURCE_SCHEMA = vol.Schema({
 
 CONF_ZONES = 'zones'
 CONF_SOURCES = 'sources'
+CONF_VOLUME_RAMP_RATE = 'volume_ramp_rate'
+
+ATTR_DURATION = 'duration'
 
 DATA_NUVO = 'nuvo'
 
 SERVICE_SNAPSHOT = 'snapshot'
 SERVICE_RESTORE = 'restore'
+SERVICE_VOLUME_RAMP = 'nuvo_volume_ramp'
+SERVICE_GROUP = 'nuvo_group'
 
 DEFAULT_PORT = 4999
 
+# Volume commands per second a ramp sends at most
+DEFAULT_VOLUME_RAMP_RATE = 4
+
+# Zones are updated by the status lines the amplifier sends on every change,
+# polling only catches anything that was missed; scan_interval overrides this
+SCAN_INTERVAL = timedelta(minutes=5)
+
 # Valid zone ids: 1-6
 ZONE_IDS = vol.All(vol.Coerce(int), vol.Range(min=1, max=6))
 
 # Valid source ids: 1-6
 SOURCE_IDS = vol.All(vol.Coerce(int), vol.Range(min=1, max=6))
 
+SERVICE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.comp_entity_ids,
+})
+
+VOLUME_RAMP_SCHEMA = SERVICE_SCHEMA.extend({
+    vol.Required(ATTR_MEDIA_VOLUME_LEVEL): cv.small_float,
+    vol.Optional(ATTR_DURATION, default=5): vol.All(
+        vol.Coerce(float), vol.Range(min=0, max=600)),
+})
+
+GROUP_SCHEMA = SERVICE_SCHEMA.extend({
+    vol.Optional(ATTR_STATE): vol.In([STATE_ON, STATE_OFF]),
+    vol.Optional(ATTR_INPUT_SOURCE): cv.string,
+    vol.Optional(ATTR_MEDIA_VOLUME_LEVEL): cv.small_float,
+    vol.Optional(ATTR_MEDIA_VOLUME_MUTED): cv.boolean,
+})
+
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Required(CONF_HOST): cv.string,
     vol.Optional(CONF_PORT, default=DEFAULT_PORT): cv.port,
     vol.Required(CONF_ZONES): vol.Schema({ZONE_IDS: ZONE_SCHEMA}),
     vol.Required(CONF_SOURCES): vol.Schema({SOURCE_IDS: SOURCE_SCHEMA}),
+    vol.Optional(CONF_VOLUME_RAMP_RATE, default=DEFAULT_VOLUME_RAMP_RATE):
+        vol.All(vol.Coerce(float), vol.Range(min=0.5, max=20)),
 })
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities,
+                               discovery_info=None):
     """Set up the Nuvo E6G 6-zone amplifier platform."""
-    
+
     port = config.get(CONF_PORT)
     hostname = config.get(CONF_HOST)
     timeout = 3
 
-    from pyitachip2sl import ITachIP2SLSocketClient
-    
-    try:
-        itach_serial = ITachIP2SLSocketClient(hostname, port, timeout)
-    except:
-        _LOGGER.error("Error connecting to iTach IP2SL")
-        return
+    # the gateway connects in the background, zones are unavailable until
+    # it has, and refresh once it is connected
+    connection = IP2SLConnection(hostname, port, timeout, TERMINATOR)
+
+    # all zones share one serial line, so they take turns through the gateway
+    metrics = Metrics('nuvo ' + hostname)
+    gateway = NuvoGateway(connection, metrics=metrics)
+    async_register_metrics(hass, metrics)
+    gateway.start()
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, gateway.async_stop)
 
     sources = {source_id: extra[CONF_NAME] for source_id, extra
                in config[CONF_SOURCES].items()}
+    ramp_rate = config[CONF_VOLUME_RAMP_RATE]
+    scan_interval = config.get(CONF_SCAN_INTERVAL, SCAN_INTERVAL)
 
     hass.data[DATA_NUVO] = []
     for zone_id, extra in config[CONF_ZONES].items():
         _LOGGER.info("Adding zone %d - %s", zone_id, extra[CONF_NAME])
         hass.data[DATA_NUVO].append(NuvoZone(
-            itach_serial, sources, zone_id, extra[CONF_NAME]))
+            gateway, sources, zone_id, extra[CONF_NAME], ramp_rate, metrics,
+            scan_interval))
 
-    add_entities(hass.data[DATA_NUVO], True)
+    async_add_entities(hass.data[DATA_NUVO])
 
-    def service_handle(service):
+    async def async_service_handle(service):
         """Handle for services."""
         entity_ids = service.data.get(ATTR_ENTITY_ID)
 
@@ -97,25 +147,93 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
         else:
             devices = hass.data[DATA_NUVO]
 
+        if service.service == SERVICE_RESTORE:
+            await async_send_frames(gateway, [
+                (device, device.restore_frames()) for device in devices])
+        elif service.service == SERVICE_GROUP:
+            await async_group_zones(gateway, sources, devices,
+                                    hass.data[DATA_NUVO], service.data)
+
         for device in devices:
             if service.service == SERVICE_SNAPSHOT:
                 device.snapshot()
-            elif service.service == SERVICE_RESTORE:
-                device.restore()
+            elif service.service == SERVICE_VOLUME_RAMP:
+                await device.async_ramp_volume(
+                    service.data[ATTR_MEDIA_VOLUME_LEVEL],
+                    service.data[ATTR_DURATION])
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_SNAPSHOT, async_service_handle, schema=SERVICE_SCHEMA)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_RESTORE, async_service_handle, schema=SERVICE_SCHEMA)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_VOLUME_RAMP, async_service_handle,
+        schema=VOLUME_RAMP_SCHEMA)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_GROUP, async_service_handle, schema=GROUP_SCHEMA)
+
+
+async def async_send_frames(gateway, zone_frames):
+    """Send the frames of several zones in one burst and apply the replies.
+
+    zone_frames is a list of (zone, frames). The burst sends the first frame
+    of every zone, then the second one and so on, so all zones power on
+    before any source or volume change.
+    """
+    burst = sorted(((index, zone, frame) for zone, frames in zone_frames
+                    for index, frame in enumerate(frames)),
+                   key=lambda command: command[0])
+    replies = await gateway.send_batch(
+        [(frame, zone.zone_id) for _, zone, frame in burst])
+    for (_, zone, _), status in zip(burst, replies):
+        if status is not None:
+            zone.apply_reply(status)
+
+
+async def async_group_zones(gateway, sources, zones, all_zones, data):
+    """Bring a set of zones to the same power, source, volume and mute."""
+    power = data.get(ATTR_STATE)
+    if power is not None:
+        power = power == STATE_ON
+    if (power is False and len(zones) == len(all_zones) and
+            sum(zone.state == STATE_ON for zone in zones) > 1):
+        # one command turns off the whole amplifier
+        status = await gateway.send(ALL_OFF_FRAME, None)
+        if status is not None:
+            for zone in zones:
+                zone.apply_reply(status)
+        return
 
-    hass.services.register(
-        DOMAIN, SERVICE_SNAPSHOT, service_handle, schema=PLATFORM_SCHEMA)
+    source = data.get(ATTR_INPUT_SOURCE)
+    source_id = None
+    if source is not None:
+        source_id = next((source_id for source_id, name in sources.items()
+                          if name == source), None)
+        if source_id is None:
+            _LOGGER.error("Unknown source: %s", source)
+            return
+    volume = data.get(ATTR_MEDIA_VOLUME_LEVEL)
+    if volume is not None:
+        volume = NuvoZone.convert_volume(volume)
 
-    hass.services.register(
-        DOMAIN, SERVICE_RESTORE, service_handle, schema=PLATFORM_SCHEMA)
+    await async_send_frames(gateway, [
+        (zone, zone.command_frames(
+            power, source_id, volume, data.get(ATTR_MEDIA_VOLUME_MUTED)))
+        for zone in zones])
 
 
-class NuvoZone(MediaPlayerEntity):
+class NuvoZone(WriteIfChangedMixin, MediaPlayerEntity):
     """Representation of a Nuvo E6G amplifier zone."""
 
-    def __init__(self, itach_serial, sources, zone_id, zone_name):
+    def __init__(self, gateway, sources, zone_id, zone_name, ramp_rate,
+                 metrics, scan_interval=SCAN_INTERVAL):
         """Initialize new zone."""
-        self._nuvo = itach_serial
+        self._nuvo = gateway
+        self._metrics = metrics
+        self._scan_interval = scan_interval
         # dict source_id -> source name
         self._source_id_name = sources
         # dict source name -> source_id
@@ -126,66 +244,109 @@ class NuvoZone(MediaPlayerEntity):
         self._zone_id = zone_id
         self._name = zone_name
 
+        self._ramp_rate = ramp_rate
+        # task sending the steps of a volume ramp
+        self._ramp = None
+
         self._snapshot = None
         self._state = STATE_OFF
         self._volume = 0
         self._source = None
         self._mute = None
 
-    def zone_status(self):
-        """Retrieve zone status from Nuvo amplifier."""
-        cmd = codecs.encode(str.encode("*Z" + str(self._zone_id) + "STATUS?\r"), "hex").decode()
-        response = self._nuvo.send_data(cmd, True)
-        status = {}
-        if response:
-            # Use debug level for normal status messages
-            _LOGGER.debug("Received response: %s", response)
-
-            # Handle ALLOFF response
-            if "#ALLOFF" in response:
-                status["power"] = False
-                return status
-
-            if ("Z" + str(self._zone_id) + ",ON") in response:
-                status["power"] = True
-                try:
-                    status["volume"] = re.search(r"(VOL)(\d+)",response).group(2)
-                except:
-                    status["volume"] = 0
-                    status["mute"] = True
-                    _LOGGER.error("Failed to parse volume from response: %s", response)
-                status["source"] = re.search(r"(SRC)(\d+)",response).group(2)
-                status["mute"] = False
-                return status
-            elif ("Z" + str(self._zone_id) + ",OFF") in response:
-                status["power"] = False
-                return status
-            else:
-                # Log unexpected responses with error level
-                _LOGGER.error("Unexpected response format: %s", response)
-                return None
+    async def async_added_to_hass(self):
+        """Listen for status the amplifier sends after keypad changes."""
+        self.async_on_remove(
+            self._nuvo.add_listener(self._zone_id, self._status_pushed))
+        self.async_on_remove(
+            self._nuvo.add_connection_listener(self._connection_changed))
+        # commands apply the status they echo, so unlike a polled entity the
+        # zone is not refreshed again after every service call
+        self.async_on_remove(async_track_time_interval(
+            self.hass, self._async_poll, self._scan_interval))
+        if self._nuvo.available:
+            # connected before the zone was added
+            self._async_schedule_refresh()
+
+    async def _async_poll(self, now=None):
+        """Poll the zone for anything the pushed status missed."""
+        await self.async_update()
+        self._async_write_if_changed()
+
+    async def async_will_remove_from_hass(self):
+        """Stop a running volume ramp."""
+        self._cancel_ramp()
+
+    def _status_pushed(self, status):
+        """Apply unsolicited status, called from the gateway."""
+        self._apply_status(status)
+        self._async_write_if_changed()
+
+    def _connection_changed(self, connected):
+        """Show the zone unavailable, or refresh it once (re)connected."""
+        if connected:
+            self._async_schedule_refresh()
         else:
-            # Log communication failures with error level
+            self._async_write_if_changed()
+
+    @callback
+    def _async_schedule_refresh(self):
+        """Refresh the zone without holding up Home Assistant's startup."""
+        self.hass.async_create_background_task(
+            self._async_poll(), 'nuvo zone {} refresh'.format(self._zone_id))
+
+    def _compact_state(self):
+        """Return a compact copy of the state Home Assistant shows."""
+        return (self.available, self._state, self._source, self._volume,
+                self._mute)
+
+    async def async_zone_status(self):
+        """Retrieve zone status from Nuvo amplifier."""
+        status = await self._async_send(
+            STATUS_FRAMES[self._zone_id], priority=PRIORITY_POLL)
+        if status is None and self._nuvo.available:
             _LOGGER.error("No response received for zone %s", self._zone_id)
-            return None
+        return status
 
-    def update(self):
+    async def async_update(self):
         """Update zone state in Home Assistant."""
-        state = self.zone_status()
+        state = await self.async_zone_status()
         if not state:
-            _LOGGER.error("Unable to update state for Zone ID: %s", self._zone_id)
+            if self._nuvo.available:
+                _LOGGER.error("Unable to update state for Zone ID: %s",
+                              self._zone_id)
             return False
-        self._state = STATE_ON if state["power"] else STATE_OFF
-        if self._state == STATE_ON:
-            self._volume = int(state["volume"])
-            self._mute = state["mute"]
-            idx = int(state["source"])
-            if idx in self._source_id_name:
-                self._source = self._source_id_name[idx]
+        self._apply_status(state)
+        return True
+
+    def _apply_status(self, status):
+        """Set zone state from a ZoneStatus."""
+        self._state = STATE_ON if status.power else STATE_OFF
+        if status.power:
+            # a muted zone does not report its volume
+            if status.volume is not None:
+                self._volume = status.volume
+            self._mute = status.mute
+            if status.source in self._source_id_name:
+                self._source = self._source_id_name[status.source]
             else:
-                _LOGGER.error("Invalid source index: %s", idx)
+                _LOGGER.error("Invalid source index: %s", status.source)
                 self._source = None
-        return True
+
+    @property
+    def zone_id(self):
+        """Return the amplifier's id of the zone."""
+        return self._zone_id
+
+    @property
+    def available(self):
+        """Return True while the amplifier is connected."""
+        return self._nuvo.available
+
+    @property
+    def should_poll(self):
+        """Zones are polled by their own timer."""
+        return False
 
     @property
     def name(self):
@@ -230,55 +391,145 @@ class NuvoZone(MediaPlayerEntity):
         return self._source_names
 
     def snapshot(self):
-        """Save zone's current state."""
-        self._snapshot = self._nuvo.zone_status(self._zone_id)
-
-    def restore(self):
-        """Restore saved state."""
-        if self._snapshot:
-            self._nuvo.restore_zone(self._snapshot)
-            self.schedule_update_ha_state(True)
-
-    def select_source(self, source):
+        """Save zone's current state, as already known to Home Assistant."""
+        self._snapshot = ZoneStatus(
+            self._zone_id, self._state == STATE_ON,
+            self._source_name_id.get(self._source), self._volume, self._mute)
+
+    def restore_frames(self):
+        """Return the frames that restore the saved state."""
+        snap = self._snapshot
+        if snap is None:
+            return []
+        self._cancel_ramp()
+        return self.command_frames(
+            snap.power, snap.source, snap.volume, snap.mute)
+
+    def command_frames(self, power=None, source=None, volume=None, mute=None):
+        """Return the frames that bring the zone to the given state.
+
+        source is a source id and volume an amplifier volume, None leaves
+        that part as it is. Only what differs from the current state is sent;
+        an off zone keeps its last source and volume, as the amplifier does.
+        """
+        zone = self._zone_id
+        is_on = self._state == STATE_ON
+        if power is None:
+            power = is_on
+        if not power:
+            return [OFF_FRAMES[zone]] if is_on else []
+
+        frames = [] if is_on else [ON_FRAMES[zone]]
+        # a muted zone ignores volume changes, unmute it first
+        if mute is False and self._mute:
+            frames.append(MUTE_FRAMES[zone])
+        if (source is not None and
+                source != self._source_name_id.get(self._source)):
+            frames.append(SOURCE_FRAMES[zone, source])
+        if volume is not None and volume != self._volume:
+            frames.append(VOLUME_FRAMES[zone, volume])
+        if mute and not self._mute:
+            frames.append(MUTE_FRAMES[zone])
+        return frames
+
+    def apply_reply(self, status):
+        """Show the zone status the amplifier echoed to a command."""
+        self._apply_status(status)
+        self._async_write_if_changed()
+
+    async def _async_command(self, frame, coalesce=None):
+        """Send a command and show the zone status the amplifier echoes."""
+        status = await self._async_send(frame, coalesce=coalesce)
+        if status is not None:
+            self.apply_reply(status)
+        return status
+
+    async def _async_send(self, frame, **kwargs):
+        """Send a frame through the gateway, timing the whole wait."""
+        start = time.monotonic()
+        status = await self._nuvo.send(frame, self._zone_id, **kwargs)
+        self._metrics.record(time.monotonic() - start, self._name,
+                             error=status is None)
+        return status
+
+    async def async_select_source(self, source):
         """Set input source."""
         if source not in self._source_name_id:
             return
         idx = self._source_name_id[source]
-        cmd = codecs.encode(str.encode("*Z" + str(self._zone_id) + "SRC" + str(idx) + "\r"), "hex").decode()
-        self._nuvo.send_data(cmd, True)
+        await self._async_command(SOURCE_FRAMES[self._zone_id, idx])
 
-    def turn_on(self):
+    async def async_turn_on(self):
         """Turn the zone on."""
-        cmd = codecs.encode(str.encode("*Z" + str(self._zone_id) + "ON\r"), "hex").decode()
-        self._nuvo.send_data(cmd, True)
+        await self._async_command(ON_FRAMES[self._zone_id])
 
-    def turn_off(self):
+    async def async_turn_off(self):
         """Turn the zone off."""
-        cmd = codecs.encode(str.encode("*Z" + str(self._zone_id) + "OFF\r"), "hex").decode()
-        self._nuvo.send_data(cmd, True)
+        await self._async_command(OFF_FRAMES[self._zone_id])
 
-    def mute_volume(self, mute):
+    async def async_mute_volume(self, mute):
         """Mute (true) or unmute (false) the zone."""
-        cmd = codecs.encode(str.encode("*Z" + str(self._zone_id) + "MUTE\r"), "hex").decode()
-        self._nuvo.send_data(cmd, True)
+        # the amplifier only has a mute toggle
+        if mute == self._mute:
+            return
+        await self._async_command(MUTE_FRAMES[self._zone_id])
 
-    def set_volume_level(self, volume):
+    async def async_set_volume_level(self, volume):
         """Set volume level, range 0..1."""
-        converted_vol = int(round((1-volume) * 80))
+        self._cancel_ramp()
+        await self._async_send_volume(self.convert_volume(volume))
 
-        cmd = codecs.encode(str.encode("*Z" + str(self._zone_id) + "VOL" + str(converted_vol) + "\r"), "hex").decode()
-        self._nuvo.send_data(cmd, True)
-
-    def volume_up(self):
+    async def async_volume_up(self):
         """Increase the volume for the zone."""
         if self._volume is None:
             return
-        cmd = codecs.encode(str.encode("*Z" + str(self._zone_id) + "VOL+\r"), "hex").decode()
-        response = self._nuvo.send_data(cmd, True)
+        self._cancel_ramp()
+        await self._async_send_volume(max(0, self._volume - 1))
 
-    def volume_down(self):
+    async def async_volume_down(self):
         """Decrease the volume for the zone."""
         if self._volume is None:
             return
-        cmd = codecs.encode(str.encode("*Z" + str(self._zone_id) + "VOL-\r"), "hex").decode()
-        self._nuvo.send_data(cmd, True)
+        self._cancel_ramp()
+        await self._async_send_volume(min(MAX_VOLUME, self._volume + 1))
+
+    async def async_ramp_volume(self, volume, duration):
+        """Fade to volume level (0..1) over duration seconds.
+
+        The ramp runs in its own task and is stopped by any other volume
+        change of the zone.
+        """
+        self._cancel_ramp()
+        start = self._volume
+        target = self.convert_volume(volume)
+        steps = min(abs(target - start), int(duration * self._ramp_rate))
+        if steps <= 1:
+            await self._async_send_volume(target)
+            return
+        self._ramp = self.hass.async_create_task(
+            self._async_ramp(start, target, steps, duration))
+
+    async def _async_ramp(self, start, target, steps, duration):
+        """Send the volume steps of a ramp, one every duration/steps."""
+        for step in range(1, steps + 1):
+            await asyncio.sleep(duration / steps)
+            await self._async_send_volume(
+                start + int(round((target - start) * step / steps)))
+
+    def _cancel_ramp(self):
+        """Stop the running volume ramp, if any."""
+        if self._ramp is not None:
+            self._ramp.cancel()
+            self._ramp = None
+
+    @staticmethod
+    def convert_volume(volume):
+        """Return the amplifier volume for a level of 0..1."""
+        return min(MAX_VOLUME, int(round((1-volume) * 80)))
+
+    async def _async_send_volume(self, converted_vol):
+        """Send a volume command, replacing one that is still queued."""
+        # steps are taken from the requested volume, not the last echo
+        self._volume = converted_vol
+        return await self._async_command(VOLUME_FRAMES[self._zone_id, converted_vol],
+                             coalesce=('volume', self._zone_id))
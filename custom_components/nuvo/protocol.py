@@ -0,0 +1,80 @@
+"""Nuvo Essentia E6G serial protocol: command frames and status parsing."""
+
+import collections
+import re
+
+ZONE_IDS = range(1, 7)
+SOURCE_IDS = range(1, 7)
+
+# The amplifier takes volume as attenuation: 0 is loudest, 79 quietest
+MAX_VOLUME = 79
+
+# Every line the amplifier sends ends with this
+TERMINATOR = b'\r\n'
+
+# Reply to a command the amplifier did not understand
+REPLY_ERROR = '#?'
+
+
+def _frame(body):
+    """Return the bytes sent to the amplifier for a command body."""
+    return ('*' + body + '\r').encode()
+
+
+# Every command frame is built once at import time
+ALL_OFF_FRAME = _frame('ALLOFF')
+STATUS_FRAMES = {zone: _frame('Z%dSTATUS?' % zone) for zone in ZONE_IDS}
+ON_FRAMES = {zone: _frame('Z%dON' % zone) for zone in ZONE_IDS}
+OFF_FRAMES = {zone: _frame('Z%dOFF' % zone) for zone in ZONE_IDS}
+MUTE_FRAMES = {zone: _frame('Z%dMUTE' % zone) for zone in ZONE_IDS}
+VOLUME_UP_FRAMES = {zone: _frame('Z%dVOL+' % zone) for zone in ZONE_IDS}
+VOLUME_DOWN_FRAMES = {zone: _frame('Z%dVOL-' % zone) for zone in ZONE_IDS}
+# dict (zone, source) -> frame
+SOURCE_FRAMES = {(zone, source): _frame('Z%dSRC%d' % (zone, source))
+                 for zone in ZONE_IDS for source in SOURCE_IDS}
+# dict (zone, attenuation) -> frame
+VOLUME_FRAMES = {(zone, volume): _frame('Z%dVOL%d' % (zone, volume))
+                 for zone in ZONE_IDS for volume in range(MAX_VOLUME + 1)}
+
+# zone is None for an all zones off (#ALLOFF) status; source and volume are
+# None when the zone is off, volume is also None while the zone is muted
+ZoneStatus = collections.namedtuple(
+    'ZoneStatus', ['zone', 'power', 'source', 'volume', 'mute'])
+
+ALL_OFF_STATUS = ZoneStatus(None, False, None, None, False)
+
+_STATUS_RE = re.compile(
+    r'#Z(?P<zone>\d),(?P<power>ON|OFF)'
+    r'(?:,SRC(?P<source>\d))?'
+    r'(?:,(?:VOL(?P<volume>\d+)|(?P<mute>MUTE)))?')
+
+
+def parse_status(line):
+    """Return the ZoneStatus of a status line, or None if it is not one."""
+    if line.startswith('#ALLOFF'):
+        return ALL_OFF_STATUS
+    match = _STATUS_RE.match(line)
+    if match is None:
+        return None
+    if match.group('power') == 'OFF':
+        return ZoneStatus(int(match.group('zone')), False, None, None, False)
+    source = match.group('source')
+    volume = match.group('volume')
+    return ZoneStatus(
+        int(match.group('zone')), True,
+        int(source) if source is not None else None,
+        int(volume) if volume is not None else None,
+        match.group('mute') is not None)
+
+
+def parse_frame(frame):
+    """Return the record of a line received from the amplifier.
+
+    Status lines become ZoneStatus records, anything else is returned as the
+    decoded line, or None if it is empty.
+    """
+    line = frame.decode(errors='replace').strip()
+    if not line:
+        return None
+    status = parse_status(line)
+    return line if status is None else status
@@ -0,0 +1,72 @@
+"""async_exchange against the simulated projector in tools/ip2sl_sim.py.
+
+No Home Assistant needed; run with python -m pytest.
+"""
+
+import asyncio
+
+from ip2sl_sim import BenQProjector, IP2SLSimulator
+
+from custom_components.benq.protocol import TERMINATOR, BenQParser, async_exchange
+from custom_components.ip2sl.connection import IP2SLConnection
+
+
+def _command(body):
+    """Return a command the way the benq switch sends it."""
+    return '\r*%s#\r' % body
+
+
+def _run(test, latency=0.0):
+    """Run test(connection, parser) against a running simulator."""
+
+    async def run():
+        simulator = IP2SLSimulator(BenQProjector(), latency=latency)
+        await simulator.start()
+        connection = IP2SLConnection('127.0.0.1', simulator.port,
+                                     terminator=TERMINATOR)
+        await connection.connect()
+        try:
+            await test(connection, BenQParser())
+        finally:
+            connection.close()
+            await simulator.stop()
+
+    asyncio.run(run())
+
+
+def test_pipelined_answers_are_matched_by_item():
+    async def test(connection, parser):
+        answers = await async_exchange(connection, parser, [
+            _command('pow=?'), _command('ltim=?'), _command('modelname=?')], 1)
+        assert answers == {'pow': 'OFF', 'ltim': '1234', 'modelname': 'W1070'}
+
+    _run(test)
+
+
+def test_error_answers_belong_to_their_command():
+    async def test(connection, parser):
+        # the projector blocks source and lamp mode while it is off
+        answers = await async_exchange(connection, parser, [
+            _command('sour=?'), _command('pow=?'), _command('lampm=?')], 1)
+        assert answers == {'sour': None, 'pow': 'OFF', 'lampm': None}
+
+    _run(test)
+
+
+def test_unanswered_items_are_left_out():
+    async def test(connection, parser):
+        assert await async_exchange(
+            connection, parser, [_command('pow=?')], 0.1) == {}
+
+    _run(test, latency=0.3)
+
+
+def test_late_answer_is_not_taken_for_the_next_exchange():
+    async def test(connection, parser):
+        assert await async_exchange(
+            connection, parser, [_command('pow=?')], 0.1) == {}
+        # the OFF answering the first query arrives during this exchange
+        assert await async_exchange(
+            connection, parser, [_command('pow=on')], 1) == {'pow': 'ON'}
+
+    _run(test, latency=0.3)
@@ -0,0 +1,45 @@
+"""The circuit breaker that guards hai-proxy requests."""
+
+import pytest
+
+from custom_components.hai.api import CircuitBreaker, HAIProxyUnavailable
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=60)
+    for _ in range(2):
+        breaker.before_request()
+        breaker.record_failure()
+    assert not breaker.is_open
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(HAIProxyUnavailable):
+        breaker.before_request()
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker('test', failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    assert breaker.is_open
+    breaker.before_request()
+    # only one probe at a time
+    with pytest.raises(HAIProxyUnavailable):
+        breaker.before_request()
+    # a failed probe keeps the breaker open
+    breaker.record_failure()
+    assert breaker.is_open
+    breaker.before_request()
+    breaker.abort()
+    breaker.before_request()
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.before_request()
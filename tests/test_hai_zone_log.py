@@ -0,0 +1,151 @@
+"""Zone log replay of HAICoordinator against tools/hai_proxy_sim.py."""
+
+import asyncio
+import tempfile
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+from hai_proxy_sim import HAIProxySimulator  # noqa: E402
+from homeassistant.core import HomeAssistant, callback  # noqa: E402
+from homeassistant.helpers.dispatcher import async_dispatcher_connect  # noqa: E402
+
+from custom_components.hai.api import HAIProxy  # noqa: E402
+from custom_components.hai.coordinator import HAICoordinator  # noqa: E402
+
+ZONE_IDS = [1, 2, 3]
+
+
+@web.middleware
+async def _no_zone_log(request, handler):
+    """Answer like a hai-proxy that keeps no zone log."""
+    if request.path == '/api/zone/log':
+        raise web.HTTPNotFound()
+    return await handler(request)
+
+
+def _run(test, log_size=10, zone_log=True):
+    """Run test(simulator, coordinator, signals) against a simulator.
+
+    signals lists (zone id, zone status) for every zone update signal, the
+    zone id None when all zones were fetched.
+    """
+
+    async def run():
+        simulator = HAIProxySimulator(0, len(ZONE_IDS), log_size=log_size)
+        app = simulator.app()
+        if not zone_log:
+            app.middlewares.append(_no_zone_log)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host = '127.0.0.1:%d' % runner.addresses[0][1]
+        hass = HomeAssistant(tempfile.mkdtemp())
+        coordinator = HAICoordinator(
+            hass, host, 2, aiohttp.ClientTimeout(total=5))
+        # the simulator speaks plain HTTP
+        coordinator.api = HAIProxy(coordinator._session, host, 'http')
+        coordinator.add_zones(ZONE_IDS)
+        coordinator.use_zone_log()
+        signals = []
+
+        @callback
+        def zone_updated(zone_id):
+            signals.append((zone_id, None if zone_id is None else
+                            coordinator.zones[zone_id]['zone_status']))
+
+        async_dispatcher_connect(hass, coordinator.zone_signal, zone_updated)
+        try:
+            await test(simulator, coordinator, signals)
+        finally:
+            await coordinator.async_close()
+            await runner.cleanup()
+            await hass.async_stop(force=True)
+
+    asyncio.run(run())
+
+
+def _statuses(coordinator):
+    """Return the zone status of every zone, by zone id."""
+    return {zone_id: zone['zone_status']
+            for zone_id, zone in coordinator.zones.items()}
+
+
+def test_changes_are_replayed_in_order():
+    async def test(simulator, coordinator, signals):
+        await coordinator.async_refresh()
+        assert sorted(coordinator.zones) == ZONE_IDS
+        assert simulator.requests['GET /api/zone'] == 1
+        simulator.set_zone(1, 'Not ready')
+        simulator.set_zone(2, 'Not ready')
+        simulator.set_zone(1, 'Secure')
+        await coordinator.async_refresh()
+        # the door that opened and closed between polls records both
+        assert signals == [(1, 'Not ready'), (2, 'Not ready'), (1, 'Secure')]
+        assert _statuses(coordinator)[2] == 'Not ready'
+        assert simulator.requests['GET /api/zone'] == 1
+
+    _run(test)
+
+
+def test_quiet_log_changes_nothing():
+    async def test(simulator, coordinator, signals):
+        await coordinator.async_refresh()
+        await coordinator.async_refresh()
+        assert signals == []
+        assert simulator.requests['GET /api/zone/log'] == 2
+
+    _run(test)
+
+
+def test_truncated_log_fetches_all_zones():
+    async def test(simulator, coordinator, signals):
+        await coordinator.async_refresh()
+        simulator.set_zone(3, 'Not ready')
+        for _ in range(3):
+            simulator.set_zone(1, 'Not ready')
+            simulator.set_zone(1, 'Secure')
+        await coordinator.async_refresh()
+        assert simulator.requests['GET /api/zone'] == 2
+        assert _statuses(coordinator) == {
+            1: 'Secure', 2: 'Secure', 3: 'Not ready'}
+        # replay picks up after the full fetch
+        simulator.set_zone(2, 'Not ready')
+        await coordinator.async_refresh()
+        assert signals[-1] == (2, 'Not ready')
+        assert simulator.requests['GET /api/zone'] == 2
+
+    _run(test, log_size=4)
+
+
+def test_replayed_changes_are_not_undone_by_a_304():
+    async def test(simulator, coordinator, signals):
+        await coordinator.async_refresh()
+        simulator.set_zone(1, 'Not ready')
+        await coordinator.async_refresh()
+        # back to the zones of the first full fetch, but the log is lost
+        simulator.set_zone(1, 'Secure')
+        for _ in range(2):
+            simulator.set_zone(2, 'Not ready')
+            simulator.set_zone(2, 'Secure')
+        await coordinator.async_refresh()
+        assert _statuses(coordinator)[1] == 'Secure'
+
+    _run(test, log_size=2)
+
+
+def test_without_zone_log_zones_are_polled():
+    async def test(simulator, coordinator, signals):
+        await coordinator.async_refresh()
+        assert sorted(coordinator.zones) == ZONE_IDS
+        simulator.set_zone(2, 'Not ready')
+        await coordinator.async_refresh()
+        assert _statuses(coordinator)[2] == 'Not ready'
+        assert simulator.requests['GET /api/zone/log'] == 1
+        assert simulator.requests['GET /api/zone'] == 2
+
+    _run(test, zone_log=False)
@@ -0,0 +1,113 @@
+"""NuvoGateway against the simulated amplifier in tools/ip2sl_sim.py.
+
+No Home Assistant needed; run with python -m pytest.
+"""
+
+import asyncio
+
+from ip2sl_sim import IP2SLSimulator, NuvoE6G
+
+from custom_components.ip2sl.connection import IP2SLConnection
+from custom_components.nuvo import protocol
+from custom_components.nuvo.gateway import PRIORITY_POLL, NuvoGateway
+
+# Seconds the simulated amplifier takes to answer, so commands queue up
+LATENCY = 0.1
+
+
+class RecordingAmplifier(NuvoE6G):
+    """Simulated amplifier that records the commands it receives."""
+
+    def __init__(self):
+        """Initialize all zones off and nothing received."""
+        super().__init__()
+        self.received = []
+
+    def handle(self, command):
+        """Record a command, then apply it."""
+        self.received.append(command)
+        return super().handle(command)
+
+
+def _run(test):
+    """Run test(amplifier, gateway) against a running simulator."""
+
+    async def run():
+        amplifier = RecordingAmplifier()
+        simulator = IP2SLSimulator(amplifier, latency=LATENCY)
+        await simulator.start()
+        connection = IP2SLConnection('127.0.0.1', simulator.port,
+                                     terminator=protocol.TERMINATOR)
+        await connection.connect()
+        gateway = NuvoGateway(connection, queue_timeout=5)
+        gateway.start()
+        try:
+            await test(amplifier, gateway)
+        finally:
+            await gateway.async_stop()
+            await simulator.stop()
+
+    asyncio.run(run())
+
+
+async def _keep_busy(gateway):
+    """Queue a status poll and wait until the worker is sending it."""
+    task = asyncio.ensure_future(
+        gateway.send(protocol.STATUS_FRAMES[6], 6, PRIORITY_POLL))
+    await asyncio.sleep(LATENCY / 2)
+    return task
+
+
+def test_commands_overtake_queued_polls():
+    async def test(amplifier, gateway):
+        busy = await _keep_busy(gateway)
+        polls = [asyncio.ensure_future(gateway.send(
+            protocol.STATUS_FRAMES[zone], zone, PRIORITY_POLL))
+            for zone in (2, 3)]
+        command = asyncio.ensure_future(
+            gateway.send(protocol.ON_FRAMES[4], 4))
+        await asyncio.gather(busy, *polls)
+        assert (await command).power
+        assert amplifier.received == [
+            '*Z6STATUS?', '*Z4ON', '*Z2STATUS?', '*Z3STATUS?']
+
+    _run(test)
+
+
+def test_queued_commands_keep_their_order():
+    async def test(amplifier, gateway):
+        busy = await _keep_busy(gateway)
+        replies = await asyncio.gather(
+            gateway.send(protocol.ON_FRAMES[1], 1),
+            gateway.send(protocol.SOURCE_FRAMES[1, 3], 1),
+            gateway.send(protocol.VOLUME_FRAMES[1, 20], 1))
+        await busy
+        assert amplifier.received[1:] == ['*Z1ON', '*Z1SRC3', '*Z1VOL20']
+        assert replies[-1] == protocol.ZoneStatus(1, True, 3, 20, False)
+
+    _run(test)
+
+
+def test_coalesced_commands_send_only_the_latest():
+    async def test(amplifier, gateway):
+        amplifier.zones[1]['power'] = True
+        busy = await _keep_busy(gateway)
+        replies = await asyncio.gather(*(
+            gateway.send(protocol.VOLUME_FRAMES[1, volume], 1,
+                         coalesce='volume 1')
+            for volume in (30, 35, 40)))
+        await busy
+        assert amplifier.received[1:] == ['*Z1VOL40']
+        # every caller gets the reply to the command that was sent
+        assert [reply.volume for reply in replies] == [40, 40, 40]
+
+    _run(test)
+
+
+def test_batch_replies_in_command_order():
+    async def test(amplifier, gateway):
+        replies = await gateway.send_batch(
+            [(protocol.ON_FRAMES[zone], zone) for zone in (3, 1, 2)])
+        assert [reply.zone for reply in replies] == [3, 1, 2]
+
+    _run(test)
@@ -0,0 +1,58 @@
+"""Frames NuvoZone sends to reach a requested state."""
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from custom_components.metrics.stats import Metrics  # noqa: E402
+from custom_components.nuvo.media_player import NuvoZone  # noqa: E402
+from custom_components.nuvo.protocol import (  # noqa: E402
+    MUTE_FRAMES, OFF_FRAMES, ON_FRAMES, SOURCE_FRAMES, VOLUME_FRAMES,
+    ZoneStatus)
+
+SOURCES = {1: 'Radio', 2: 'TV'}
+
+
+def _zone(status=None):
+    """Return zone 1, showing status if given."""
+    zone = NuvoZone(None, SOURCES, 1, 'Kitchen', 0, Metrics('test'))
+    if status is not None:
+        zone._apply_status(status)
+    return zone
+
+
+def test_unchanged_state_sends_nothing():
+    zone = _zone(ZoneStatus(1, True, 1, 30, False))
+    assert zone.command_frames(True, 1, 30, False) == []
+    assert zone.command_frames() == []
+
+
+def test_only_differences_are_sent():
+    zone = _zone(ZoneStatus(1, True, 1, 30, False))
+    assert zone.command_frames(True, 1, 40, False) == [VOLUME_FRAMES[1, 40]]
+    assert zone.command_frames(source=2) == [SOURCE_FRAMES[1, 2]]
+
+
+def test_off_zone_is_turned_on_first():
+    zone = _zone(ZoneStatus(1, False, None, None, False))
+    assert zone.command_frames(True, 2, 30) == [
+        ON_FRAMES[1], SOURCE_FRAMES[1, 2], VOLUME_FRAMES[1, 30]]
+
+
+def test_power_off():
+    assert _zone(ZoneStatus(1, True, 1, 30, False)).command_frames(
+        False, 2, 40, True) == [OFF_FRAMES[1]]
+    assert _zone(ZoneStatus(1, False, None, None, False)).command_frames(
+        False) == []
+
+
+def test_muted_zone_is_unmuted_before_volume_changes():
+    zone = _zone(ZoneStatus(1, True, 1, None, True))
+    assert zone.command_frames(True, 1, 40, False) == [
+        MUTE_FRAMES[1], VOLUME_FRAMES[1, 40]]
+
+
+def test_zone_is_muted_after_volume_changes():
+    zone = _zone(ZoneStatus(1, True, 1, 30, False))
+    assert zone.command_frames(True, 1, 40, True) == [
+        VOLUME_FRAMES[1, 40], MUTE_FRAMES[1]]
@@ -0,0 +1,103 @@
+"""Parsing of Nuvo and BenQ replies and IP2SL framing.
+
+None of these need Home Assistant; run with python -m pytest.
+"""
+
+import asyncio
+
+import pytest
+
+from custom_components.benq.protocol import BenQParser, command_item
+from custom_components.ip2sl.connection import IP2SLConnection
+from custom_components.nuvo import protocol
+from custom_components.nuvo.protocol import ZoneStatus, parse_frame, parse_status
+
+
+@pytest.mark.parametrize('line, status', [
+    ('#Z2,ON,SRC1,MUTE,DND0', ZoneStatus(2, True, 1, None, True)),
+    ('#Z1,ON,SRC3,VOL45,DND0,LOCK0', ZoneStatus(1, True, 3, 45, False)),
+    ('#Z3,OFF', ZoneStatus(3, False, None, None, False)),
+    ('#ALLOFF', protocol.ALL_OFF_STATUS),
+])
+def test_parse_status(line, status):
+    assert parse_status(line) == status
+
+
+@pytest.mark.parametrize('line', ['#?', '#Z2PWRON', '*Z2ON', ''])
+def test_parse_status_rejects_other_lines(line):
+    assert parse_status(line) is None
+
+
+def test_parse_frame():
+    assert parse_frame(b'#Z4,ON,SRC2,VOL0 ') == ZoneStatus(4, True, 2, 0, False)
+    assert parse_frame(b'#?') == protocol.REPLY_ERROR
+    assert parse_frame(b'  ') is None
+    # garbage on the line is decoded, not raised
+    assert parse_frame(b'#\xffZ') == '#�Z'
+
+
+def test_benq_answers():
+    parser = BenQParser()
+    assert parser.parse(b'>*pow=?#') is None
+    assert parser.parse(b'*POW=ON#') == ('pow', 'ON')
+    assert parser.parse(b'*LTIM=1234#\r') == ('ltim', '1234')
+    assert parser.parse(b'') is None
+
+
+def test_benq_error_belongs_to_echoed_command():
+    parser = BenQParser()
+    parser.parse(b'>*lampm=?#')
+    assert parser.parse(b'*Block item#') == ('lampm', None)
+    parser.parse(b'>*modelname=?#')
+    assert parser.parse(b'*Illegal format#') == ('modelname', None)
+    parser.reset()
+    assert parser.parse(b'*Block item#') == (None, None)
+
+
+def test_command_item():
+    assert command_item('\r*sour=?#\r') == 'sour'
+    assert command_item('garbage') is None
+
+
+def _read_frames(chunks, timeout=None):
+    """Serve chunks from a local server and return the frames read."""
+
+    async def run():
+        async def serve(reader, writer):
+            for chunk in chunks:
+                writer.write(chunk)
+                await writer.drain()
+                await asyncio.sleep(0.05)
+            writer.close()
+
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        connection = IP2SLConnection('127.0.0.1', port,
+                                     terminator=protocol.TERMINATOR)
+        await connection.connect()
+        frames = []
+        try:
+            while True:
+                frames.append(await connection.read_frame(timeout))
+        except OSError:
+            # the server closed the connection after the last chunk
+            pass
+        finally:
+            connection.close()
+            server.close()
+            await server.wait_closed()
+        return frames
+
+    return asyncio.run(run())
+
+
+def test_read_frame_joins_split_segments():
+    frames = _read_frames(
+        [b'#Z2,ON,', b'SRC1,MUTE,DND0\r', b'\n#ALLOFF\r\n#', b'?\r\n'])
+    assert frames == [b'#Z2,ON,SRC1,MUTE,DND0', b'#ALLOFF', b'#?']
+
+
+def test_read_frame_keeps_partial_frame_on_timeout():
+    frames = _read_frames([b'#Z3,', b'OFF\r\n'], timeout=0.01)
+    assert frames[0] is None
+    assert [frame for frame in frames if frame is not None] == [b'#Z3,OFF']
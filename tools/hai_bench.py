@@ -0,0 +1,149 @@
+"""Benchmark HAI poll cycles and commands against the hai-proxy simulator.
+
+Runs the hai-proxy client used by the HAI platforms against an in-process
+HAIProxySimulator and reports requests per poll cycle, poll latency and
+command round-trip time for a given entity count.
+
+    python tools/hai_bench.py --units 120 --zones 60 --latency 0.01
+
+--per-entity emulates the old one-GET-per-entity polling for comparison.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_components.hai.api import HAIProxy, HAIProxyError  # noqa: E402
+from hai_proxy_sim import HAIProxySimulator  # noqa: E402
+
+
+def percentile(samples, pct):
+    """Return the pct percentile of samples (nearest rank)."""
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1,
+                      int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def report(label, samples):
+    """Print p50/p99 of a list of durations in seconds."""
+    print('%-22s p50 %8.2f ms   p99 %8.2f ms   (n=%d)' % (
+        label, percentile(samples, 50) * 1000,
+        percentile(samples, 99) * 1000, len(samples)))
+
+
+async def poll_bulk(api, units, zones):
+    """Poll the way the shared coordinator does: one request per kind."""
+    await asyncio.gather(api.get_units(), api.get_zones())
+
+
+async def poll_per_entity(session, base_url, units, zones):
+    """Poll the way the platforms used to: one request per entity."""
+    async def fetch(url):
+        async with session.get(url) as r:
+            await r.json()
+
+    await asyncio.gather(
+        *(fetch(base_url + 'light/%d' % unit_id) for unit_id in units),
+        *(fetch(base_url + 'zone/%d' % zone_id) for zone_id in zones))
+
+
+async def run(args):
+    """Run the benchmark and print its report."""
+    simulator = HAIProxySimulator(
+        args.units, args.zones, args.latency, args.jitter, args.error_rate)
+    runner = web.AppRunner(simulator.app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host = '127.0.0.1:%d' % runner.addresses[0][1]
+
+    units = list(simulator.units)
+    zones = list(simulator.zones)
+    async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=args.pool_size)) as session:
+        api = HAIProxy(session, host, scheme='http')
+
+        poll_times = []
+        errors = 0
+        simulator.reset_stats()
+        for _ in range(args.cycles):
+            # change a few units between polls so not every poll is a 304
+            for unit_id in random.sample(units, min(len(units), args.changes)):
+                simulator.set_unit(unit_id, {'is_on': random.random() < 0.5})
+            start = time.perf_counter()
+            try:
+                if args.per_entity:
+                    await poll_per_entity(session, api.api_url, units, zones)
+                else:
+                    await poll_bulk(api, units, zones)
+            except (HAIProxyError, aiohttp.ClientError):
+                errors += 1
+            poll_times.append(time.perf_counter() - start)
+        poll_requests = sum(simulator.requests.values())
+
+        command_times = []
+        for _ in range(args.commands if units else 0):
+            start = time.perf_counter()
+            try:
+                await api.set_unit(random.choice(units),
+                                   {'is_on': True, 'brightness_level': 50})
+            except HAIProxyError:
+                errors += 1
+            command_times.append(time.perf_counter() - start)
+
+        simulator.reset_stats()
+        start = time.perf_counter()
+        try:
+            await api.set_units({unit_id: {'is_on': False} for unit_id in units})
+        except HAIProxyError:
+            errors += 1
+        batch_time = time.perf_counter() - start
+        batch_requests = sum(simulator.requests.values())
+
+    await runner.cleanup()
+
+    print('%s polling, %d units, %d zones, %d cycles, %.0f ms latency' % (
+        'per-entity' if args.per_entity else 'bulk', len(units), len(zones),
+        args.cycles, args.latency * 1000))
+    print('%-22s %8.2f' % ('requests per cycle', poll_requests / args.cycles))
+    report('poll cycle', poll_times)
+    report('command round trip', command_times)
+    print('%-22s %8.2f ms   (%d requests)' % (
+        'batch of %d units' % len(units), batch_time * 1000, batch_requests))
+    print('%-22s %8d' % ('errors', errors))
+
+
+def main():
+    """Parse arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--units', type=int, default=120)
+    parser.add_argument('--zones', type=int, default=60)
+    parser.add_argument('--cycles', type=int, default=50)
+    parser.add_argument('--commands', type=int, default=100)
+    parser.add_argument('--changes', type=int, default=2,
+                        help='units changed between poll cycles')
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--per-entity', action='store_true',
+                        help='poll one request per entity like before')
+    args = parser.parse_args()
+    if args.cycles < 1:
+        parser.error('--cycles must be at least 1')
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
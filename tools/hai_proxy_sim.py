@@ -0,0 +1,288 @@
+"""Local stand-in for the hai-proxy REST API.
+
+Simulates up to 255 units and zones with configurable latency and error
+injection, so the HAI platforms can be exercised without an Omni panel.
+
+    python tools/hai_proxy_sim.py --units 120 --zones 60 --latency 0.02
+
+Besides the hai-proxy endpoints it serves GET /sim/stats (request counters)
+and POST /sim/zone/<id> with {"zone_status": ...} to trip a zone.
+
+Zone changes are kept in a log of the last --log-size changes, served by
+GET /api/zone/log?since=<seq> as {"seq": <latest seq>, "truncated": <bool>,
+"events": [<zone record with its "seq">, ...]}. truncated is set when the
+log no longer holds every change after since, or since is missing.
+"""
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import random
+import ssl
+
+from aiohttp import web
+
+MAX_ID = 255
+
+ZONE_SECURE = 'Secure'
+ZONE_NOT_READY = 'Not ready'
+
+# Zone changes kept for GET /api/zone/log
+DEFAULT_LOG_SIZE = 1000
+
+
+class HAIProxySimulator:
+    """In-memory Omni units and zones behind a hai-proxy style API."""
+
+    def __init__(self, units=MAX_ID, zones=MAX_ID, latency=0.0, jitter=0.0,
+                 error_rate=0.0, hang_rate=0.0, zone_activity=0.0,
+                 log_size=DEFAULT_LOG_SIZE):
+        """Initialize the simulator.
+
+        latency and jitter are in seconds, error_rate and hang_rate are the
+        share of API requests answered with a 500 or never answered, and
+        zone_activity is the number of random zone changes per second.
+        log_size is the number of zone changes kept in the zone log.
+        """
+        if not 0 <= units <= MAX_ID or not 0 <= zones <= MAX_ID:
+            raise ValueError('units and zones must be 0-%d' % MAX_ID)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.zone_activity = zone_activity
+        self.units = {
+            unit_id: {'id': unit_id, 'name': 'Unit %d' % unit_id,
+                      'is_on': False, 'brightness_level': 0}
+            for unit_id in range(1, units + 1)}
+        self.zones = {
+            zone_id: {'id': zone_id, 'name': 'Zone %d' % zone_id,
+                      'zone_status': ZONE_SECURE}
+            for zone_id in range(1, zones + 1)}
+        # counters keyed by "METHOD /route"
+        self.requests = collections.Counter()
+        # sequence number of the latest zone change, and the latest changes
+        self.zone_seq = 0
+        self.zone_log = collections.deque(maxlen=log_size)
+        self._feeds = set()
+        self._activity_task = None
+
+    def reset_stats(self):
+        """Clear the request counters."""
+        self.requests.clear()
+
+    def set_unit(self, unit_id, state):
+        """Apply a command the way the Omni controller reports it back."""
+        unit = self.units[unit_id]
+        unit['is_on'] = bool(state.get('is_on', unit['is_on']))
+        if not unit['is_on']:
+            unit['brightness_level'] = 0
+        elif 'brightness_level' in state:
+            # dimmed units report their level offset by 100
+            unit['brightness_level'] = 100 + int(state['brightness_level'])
+        else:
+            unit['brightness_level'] = 1
+
+    def set_zone(self, zone_id, zone_status):
+        """Change a zone, log it and push it to every open event feed."""
+        zone = self.zones[zone_id]
+        zone['zone_status'] = zone_status
+        self.zone_seq += 1
+        self.zone_log.append(dict(zone, seq=self.zone_seq))
+        for queue in self._feeds:
+            queue.put_nowait(dict(zone))
+
+    def app(self):
+        """Return the aiohttp application serving the simulated API."""
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes([
+            web.get('/api/light', self._get_units),
+            web.put('/api/light', self._put_units),
+            web.get('/api/light/{id:\\d+}', self._get_unit),
+            web.put('/api/light/{id:\\d+}', self._put_unit),
+            web.get('/api/zone', self._get_zones),
+            web.get('/api/zone/events', self._zone_events),
+            web.get('/api/zone/log', self._get_zone_log),
+            web.get('/api/zone/{id:\\d+}', self._get_zone),
+            web.get('/sim/stats', self._stats),
+            web.post('/sim/zone/{id:\\d+}', self._trip_zone),
+        ])
+        app.on_startup.append(self._start_activity)
+        app.on_cleanup.append(self._stop_activity)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        """Count requests and inject latency and errors into API calls."""
+        if not request.path.startswith('/api/'):
+            return await handler(request)
+        route = request.match_info.route.resource
+        self.requests[request.method + ' ' +
+                      (route.canonical if route else request.path)] += 1
+        if request.path == '/api/zone/events':
+            return await handler(request)
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(
+                0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.hang_rate:
+            await asyncio.Event().wait()
+        if random.random() < self.error_rate:
+            raise web.HTTPInternalServerError(text='injected error')
+        return await handler(request)
+
+    @staticmethod
+    def _conditional(request, items):
+        """Return a JSON list response, or 304 if the client has it."""
+        body = json.dumps(list(items.values())).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='application/json',
+                            headers={'ETag': etag})
+
+    def _lookup(self, items, request):
+        """Return the item addressed by the {id} route parameter."""
+        item = items.get(int(request.match_info['id']))
+        if item is None:
+            raise web.HTTPNotFound()
+        return item
+
+    async def _get_units(self, request):
+        """Return all units."""
+        return self._conditional(request, self.units)
+
+    async def _get_unit(self, request):
+        """Return one unit."""
+        return web.json_response(self._lookup(self.units, request))
+
+    async def _put_unit(self, request):
+        """Command one unit."""
+        unit = self._lookup(self.units, request)
+        self.set_unit(unit['id'], await request.json())
+        return web.Response(status=202)
+
+    async def _put_units(self, request):
+        """Command several units at once."""
+        states = await request.json()
+        if any(int(state['id']) not in self.units for state in states):
+            raise web.HTTPNotFound()
+        for state in states:
+            self.set_unit(int(state['id']), state)
+        return web.Response(status=202)
+
+    async def _get_zones(self, request):
+        """Return all zones."""
+        return self._conditional(request, self.zones)
+
+    async def _get_zone(self, request):
+        """Return one zone."""
+        return web.json_response(self._lookup(self.zones, request))
+
+    async def _get_zone_log(self, request):
+        """Return the zone changes after the since sequence number."""
+        try:
+            since = int(request.query['since'])
+        except KeyError:
+            since = None
+        except ValueError:
+            raise web.HTTPBadRequest(text='since must be an integer')
+        first = self.zone_log[0]['seq'] if self.zone_log else self.zone_seq + 1
+        # a cursor ahead of the log means the simulator was restarted
+        truncated = since is None or since < first - 1 or since > self.zone_seq
+        events = [] if truncated else [
+            zone for zone in self.zone_log if zone['seq'] > since]
+        return web.json_response({
+            'seq': self.zone_seq, 'truncated': truncated, 'events': events})
+
+    async def _zone_events(self, request):
+        """Stream zone changes as server-sent events."""
+        response = web.StreamResponse(
+            headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        queue = asyncio.Queue()
+        self._feeds.add(queue)
+        try:
+            while True:
+                try:
+                    zone = await asyncio.wait_for(queue.get(), 15)
+                except asyncio.TimeoutError:
+                    await response.write(b': keep-alive\n\n')
+                    continue
+                await response.write(
+                    b'data: ' + json.dumps(zone).encode() + b'\n\n')
+        except ConnectionResetError:
+            # the client went away
+            return response
+        finally:
+            self._feeds.discard(queue)
+
+    async def _stats(self, request):
+        """Return the request counters."""
+        return web.json_response(dict(self.requests))
+
+    async def _trip_zone(self, request):
+        """Change a zone on request of a test."""
+        zone = self._lookup(self.zones, request)
+        body = await request.json()
+        self.set_zone(zone['id'], body.get('zone_status', ZONE_NOT_READY))
+        return web.json_response(zone)
+
+    async def _start_activity(self, app):
+        """Start random zone changes if enabled."""
+        if self.zone_activity and self.zones:
+            self._activity_task = asyncio.ensure_future(self._random_activity())
+
+    async def _stop_activity(self, app):
+        """Stop random zone changes."""
+        if self._activity_task is not None:
+            self._activity_task.cancel()
+
+    async def _random_activity(self):
+        """Open and close random zones at the configured rate."""
+        while True:
+            await asyncio.sleep(random.expovariate(self.zone_activity))
+            zone_id = random.choice(list(self.zones))
+            status = self.zones[zone_id]['zone_status']
+            self.set_zone(zone_id, ZONE_SECURE if status == ZONE_NOT_READY
+                          else ZONE_NOT_READY)
+
+
+def main():
+    """Run the simulator until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--units', type=int, default=MAX_ID)
+    parser.add_argument('--zones', type=int, default=MAX_ID)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every API request')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random +/- seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of API requests answered with HTTP 500')
+    parser.add_argument('--hang-rate', type=float, default=0.0,
+                        help='share of API requests never answered')
+    parser.add_argument('--zone-activity', type=float, default=0.0,
+                        help='random zone changes per second')
+    parser.add_argument('--log-size', type=int, default=DEFAULT_LOG_SIZE,
+                        help='zone changes kept for GET /api/zone/log')
+    parser.add_argument('--certfile', help='serve HTTPS with this certificate')
+    parser.add_argument('--keyfile', help='private key for --certfile')
+    args = parser.parse_args()
+
+    ssl_context = None
+    if args.certfile:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(args.certfile, args.keyfile)
+
+    simulator = HAIProxySimulator(
+        args.units, args.zones, args.latency, args.jitter, args.error_rate,
+        args.hang_rate, args.zone_activity, args.log_size)
+    web.run_app(simulator.app(), host=args.host, port=args.port,
+                ssl_context=ssl_context)
+
+
+if __name__ == '__main__':
+    main()
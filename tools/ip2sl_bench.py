@@ -0,0 +1,161 @@
+"""Benchmark the Nuvo and BenQ serial paths against the IP2SL simulator.
+
+Runs the gateway and connection used by the nuvo and benq platforms against
+an in-process IP2SLSimulator and reports commands per second, the time to
+poll all six zones and command latency while zones are being polled.
+
+    python tools/ip2sl_bench.py --baud 9600 --fragment 0.3
+    python tools/ip2sl_bench.py --device benq
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_components.benq import protocol as benq  # noqa: E402
+from custom_components.ip2sl.connection import IP2SLConnection  # noqa: E402
+from custom_components.nuvo.gateway import (  # noqa: E402
+    NuvoGateway, PRIORITY_POLL)
+from custom_components.nuvo.protocol import (  # noqa: E402
+    ON_FRAMES, STATUS_FRAMES, TERMINATOR, VOLUME_FRAMES, ZONE_IDS)
+from hai_bench import report  # noqa: E402
+from ip2sl_sim import DEVICES, IP2SLSimulator  # noqa: E402
+
+BENQ_QUERIES = ['pow', 'ltim', 'sour', 'lampm', 'modelname']
+# Framing of a command, as in the CMD_DICT of the benq switch
+BENQ_COMMAND = '\r*%s#\r'
+
+
+async def bench_nuvo(args, port):
+    """Measure the Nuvo gateway."""
+    connection = IP2SLConnection('127.0.0.1', port, terminator=TERMINATOR)
+    await connection.connect()
+    gateway = NuvoGateway(connection)
+    gateway.start()
+    pushed = []
+    for zone_id in ZONE_IDS:
+        gateway.add_listener(zone_id, pushed.append)
+        await gateway.send(ON_FRAMES[zone_id], zone_id)
+
+    start = time.perf_counter()
+    for index in range(args.commands):
+        await gateway.send(VOLUME_FRAMES[1, index % 80], 1)
+    rate = args.commands / (time.perf_counter() - start)
+
+    # Home Assistant polls every zone from its own task
+    poll_times = []
+    for _ in range(args.cycles):
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            gateway.send(STATUS_FRAMES[zone_id], zone_id, PRIORITY_POLL)
+            for zone_id in ZONE_IDS))
+        poll_times.append(time.perf_counter() - start)
+
+    async def poll():
+        """Poll all zones back to back until cancelled."""
+        while True:
+            for zone_id in ZONE_IDS:
+                await gateway.send(
+                    STATUS_FRAMES[zone_id], zone_id, PRIORITY_POLL)
+
+    command_times = []
+    errors = 0
+    pollers = [asyncio.ensure_future(poll()) for _ in range(2)]
+    for index in range(args.commands):
+        start = time.perf_counter()
+        if await gateway.send(VOLUME_FRAMES[2, index % 80], 2) is None:
+            errors += 1
+        command_times.append(time.perf_counter() - start)
+    for poller in pollers:
+        poller.cancel()
+    await gateway.async_stop()
+
+    print('%-22s %8.1f' % ('commands per second', rate))
+    report('poll cycle (6 zones)', poll_times)
+    report('command while polling', command_times)
+    print('%-22s %8d' % ('unsolicited received', len(pushed)))
+    return errors
+
+
+async def bench_benq(args, port):
+    """Measure a full attribute refresh, one query at a time and pipelined.
+
+    Both use async_exchange, the exchange of the benq switch.
+    """
+    connection = IP2SLConnection(
+        '127.0.0.1', port, terminator=benq.TERMINATOR)
+    await connection.connect()
+    parser = benq.BenQParser()
+    await benq.async_exchange(
+        connection, parser, [BENQ_COMMAND % 'pow=on'], 1)
+    queries = [BENQ_COMMAND % (key + '=?') for key in BENQ_QUERIES]
+
+    refresh_times = []
+    errors = 0
+    for _ in range(args.cycles):
+        start = time.perf_counter()
+        for query in queries:
+            answers = await benq.async_exchange(
+                connection, parser, [query], 1)
+            errors += not answers
+        refresh_times.append(time.perf_counter() - start)
+
+    batch_times = []
+    for _ in range(args.cycles):
+        start = time.perf_counter()
+        answers = await benq.async_exchange(connection, parser, queries, 1)
+        errors += len(queries) - len(answers)
+        batch_times.append(time.perf_counter() - start)
+    connection.close()
+
+    total = sum(refresh_times)
+    print('%-22s %8.1f' % ('queries per second',
+                           args.cycles * len(BENQ_QUERIES) / total))
+    report('one at a time', refresh_times)
+    report('pipelined', batch_times)
+    return errors
+
+
+async def run(args):
+    """Run the simulator and the benchmark on one event loop."""
+    simulator = IP2SLSimulator(
+        DEVICES[args.device](), args.baud, args.fragment, args.latency,
+        args.activity, args.network_latency)
+    await simulator.start()
+    print('%s at %d baud, %.0f%% fragmented, %.0f ms device latency, '
+          '%.0f ms network latency' % (
+              args.device, args.baud, args.fragment * 100,
+              args.latency * 1000, args.network_latency * 1000))
+    if args.device == 'nuvo':
+        errors = await bench_nuvo(args, simulator.port)
+    else:
+        errors = await bench_benq(args, simulator.port)
+    await simulator.stop()
+    print('%-22s %8d' % ('errors', errors))
+    print('%-22s %8d' % ('serial commands', simulator.stats['commands']))
+
+
+def main():
+    """Parse arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--device', choices=sorted(DEVICES), default='nuvo')
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--commands', type=int, default=100)
+    parser.add_argument('--baud', type=int, default=9600)
+    parser.add_argument('--fragment', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--activity', type=float, default=0.0)
+    parser.add_argument('--network-latency', type=float, default=0.0)
+    args = parser.parse_args()
+    if args.cycles < 1 or args.commands < 1:
+        parser.error('--cycles and --commands must be at least 1')
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Local stand-in for a Global Cache iTach IP2SL and the device behind it.
+
+Emulates the serial port of a Nuvo Essentia E6G amplifier or a BenQ
+projector on a TCP port, the way the IP2SL exposes it, so the nuvo and benq
+platforms can be exercised without hardware.
+
+    python tools/ip2sl_sim.py --device nuvo --baud 9600 --fragment 0.5
+
+Replies are paced at the serial baud rate and can be split into several
+TCP segments. The amplifier also sends status lines by itself when
+--activity simulates keypad changes.
+"""
+
+import argparse
+import asyncio
+import collections
+import random
+import re
+
+DEFAULT_PORT = 4999
+
+# start bit, 8 data bits, stop bit
+BITS_PER_BYTE = 10
+
+
+class NuvoE6G:
+    """Six zones of a Nuvo E6G answering its serial protocol."""
+
+    terminator = b'\r'
+
+    _COMMAND_RE = re.compile(r'\*Z(?P<zone>[1-6])(?P<command>.+)')
+
+    def __init__(self, sources=6):
+        """Initialize all zones off."""
+        self.sources = sources
+        self.zones = {zone: {'power': False, 'source': 1, 'volume': 40,
+                             'mute': False}
+                      for zone in range(1, 7)}
+
+    def status(self, zone_id):
+        """Return the status line of a zone."""
+        zone = self.zones[zone_id]
+        if not zone['power']:
+            return '#Z%d,OFF' % zone_id
+        return '#Z%d,ON,SRC%d,%s,DND0' % (
+            zone_id, zone['source'],
+            'MUTE' if zone['mute'] else 'VOL%d' % zone['volume'])
+
+    def handle(self, command):
+        """Apply a command, return the lines the amplifier answers."""
+        if command == '*ALLOFF':
+            for zone in self.zones.values():
+                zone['power'] = False
+            return ['#ALLOFF']
+        match = self._COMMAND_RE.fullmatch(command)
+        if match is None:
+            return ['#?']
+        zone_id = int(match.group('zone'))
+        zone = self.zones[zone_id]
+        command = match.group('command')
+        if command == 'ON':
+            zone['power'] = True
+        elif command == 'OFF':
+            zone['power'] = False
+        elif command == 'STATUS?':
+            pass
+        elif not zone['power']:
+            return ['#?']
+        elif command == 'MUTE':
+            zone['mute'] = not zone['mute']
+        elif command == 'VOL+':
+            zone['volume'] = max(0, zone['volume'] - 1)
+        elif command == 'VOL-':
+            zone['volume'] = min(79, zone['volume'] + 1)
+        elif re.fullmatch(r'VOL\d{1,2}', command) and int(command[3:]) <= 79:
+            zone['volume'] = int(command[3:])
+        elif (re.fullmatch(r'SRC\d', command) and
+              1 <= int(command[3:]) <= self.sources):
+            zone['source'] = int(command[3:])
+        else:
+            return ['#?']
+        return [self.status(zone_id)]
+
+    def random_change(self):
+        """Change a zone the way a keypad would, return its status lines."""
+        zone_id = random.randint(1, 6)
+        zone = self.zones[zone_id]
+        if not zone['power']:
+            zone['power'] = True
+        elif random.random() < 0.5:
+            zone['volume'] = random.randint(0, 79)
+        else:
+            zone['source'] = random.randint(1, self.sources)
+        return [self.status(zone_id)]
+
+
+class BenQProjector:
+    """A BenQ projector answering its RS-232 query protocol."""
+
+    terminator = b'\r'
+
+    _COMMAND_RE = re.compile(r'\*(?P<key>[a-z]+)=(?P<value>[^#]+)#')
+
+    # items the projector only answers while it is on
+    _NEEDS_POWER = ('sour', 'lampm')
+
+    def __init__(self, model='W1070'):
+        """Initialize a projector that is off."""
+        self.values = {'pow': 'OFF', 'ltim': '1234', 'sour': 'HDMI',
+                       'lampm': 'LNOR', 'modelname': model}
+
+    def handle(self, command):
+        """Apply a command, return the lines the projector answers."""
+        # the projector echoes every command, the answer follows \r\r\n
+        echo = '>' + command + '\r'
+        match = self._COMMAND_RE.fullmatch(command)
+        if match is None or match.group('key') not in self.values:
+            return [echo, '*Illegal format#']
+        key, value = match.group('key'), match.group('value')
+        if key in self._NEEDS_POWER and self.values['pow'] != 'ON':
+            return [echo, '*Block item#']
+        if value != '?':
+            if key != 'pow' or value not in ('on', 'off'):
+                return [echo, '*Block item#']
+            self.values['pow'] = value.upper()
+        return [echo, '*%s=%s#' % (key.upper(), self.values[key])]
+
+    def random_change(self):
+        """The projector never talks by itself."""
+        return []
+
+
+DEVICES = {'nuvo': NuvoE6G, 'benq': BenQProjector}
+
+
+class IP2SLSimulator:
+    """Serve a simulated serial device on a TCP port like an IP2SL."""
+
+    def __init__(self, device, baud=9600, fragment=0.0, latency=0.0,
+                 activity=0.0, network_latency=0.0):
+        """Initialize the simulator.
+
+        baud paces every reply, fragment is the share of replies split into
+        several TCP segments, latency the seconds the device takes to answer
+        and activity the number of unsolicited changes per second.
+        network_latency is added once to every TCP segment received, like
+        the network round trip to a real IP2SL.
+        """
+        self.device = device
+        self.baud = baud
+        self.fragment = fragment
+        self.latency = latency
+        self.activity = activity
+        self.network_latency = network_latency
+        # counters of commands, replies and unsolicited lines
+        self.stats = collections.Counter()
+        self._writers = set()
+        # tasks serving the connected clients
+        self._clients = set()
+        # the serial line sends one byte at a time, whoever it is for
+        self._line = asyncio.Lock()
+        self._server = None
+        self._activity_task = None
+
+    @property
+    def port(self):
+        """Return the port the simulator listens on."""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening, port 0 picks a free port."""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        if self.activity:
+            self._activity_task = asyncio.ensure_future(self._random_activity())
+
+    async def stop(self):
+        """Close the server and all connections."""
+        if self._activity_task is not None:
+            self._activity_task.cancel()
+        for writer in list(self._writers):
+            writer.close()
+        if self._clients:
+            # the clients see the closed connections and return
+            await asyncio.wait(self._clients, timeout=1)
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        """Pass commands of one client to the device and send the replies."""
+        self._writers.add(writer)
+        self._clients.add(asyncio.current_task())
+        buffer = b''
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                if self.network_latency:
+                    await asyncio.sleep(self.network_latency)
+                buffer += data
+                *commands, buffer = buffer.split(self.device.terminator)
+                for command in commands:
+                    command = command.decode(errors='replace').strip()
+                    if not command:
+                        continue
+                    self.stats['commands'] += 1
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    lines = self.device.handle(command)
+                    if lines:
+                        self.stats['replies'] += 1
+                        await self._send(writer, lines)
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._clients.discard(asyncio.current_task())
+            writer.close()
+
+    async def _send(self, writer, lines):
+        """Write lines at the baud rate, possibly in several segments."""
+        data = ''.join(line + '\r\n' for line in lines).encode()
+        async with self._line:
+            chunks = [data]
+            if len(data) > 1 and random.random() < self.fragment:
+                cut = random.randint(1, len(data) - 1)
+                chunks = [data[:cut], data[cut:]]
+            for chunk in chunks:
+                if self.baud:
+                    await asyncio.sleep(len(chunk) * BITS_PER_BYTE / self.baud)
+                writer.write(chunk)
+                await writer.drain()
+
+    async def _random_activity(self):
+        """Make random unsolicited changes and send them to all clients."""
+        while True:
+            await asyncio.sleep(random.expovariate(self.activity))
+            lines = self.device.random_change()
+            if not lines:
+                continue
+            self.stats['unsolicited'] += 1
+            for writer in list(self._writers):
+                try:
+                    await self._send(writer, lines)
+                except ConnectionError:
+                    pass
+
+
+async def serve(args):
+    """Run the simulator until cancelled."""
+    simulator = IP2SLSimulator(
+        DEVICES[args.device](), args.baud, args.fragment, args.latency,
+        args.activity, args.network_latency)
+    await simulator.start(args.host, args.port)
+    print('Simulating a %s on %s:%d' % (args.device, args.host, simulator.port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+def main():
+    """Run the simulator until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--device', choices=sorted(DEVICES), default='nuvo')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--baud', type=int, default=9600,
+                        help='serial speed replies are paced at, 0 for none')
+    parser.add_argument('--fragment', type=float, default=0.0,
+                        help='share of replies split into two TCP segments')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the device takes to answer')
+    parser.add_argument('--activity', type=float, default=0.0,
+                        help='unsolicited keypad changes per second')
+    parser.add_argument('--network-latency', type=float, default=0.0,
+                        help='seconds added to every TCP segment received')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()